@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+"""Deduce Benchmark
+
+Build deduce brains from synthetic knowledge bases of several sizes and
+report how quickly they learn, how quickly they answer, how much memory
+they take and how quickly their snapshots load back in.
+
+A knowledge base mixes deep IS chains, a wide taxonomy, instances of its
+kinds, facts about many verbs and a share of negated facts.  It is the
+same for the same options and seed, so runs can be compared to catch
+regressions.  Each size is measured in a process of its own, so that
+its peak resident memory is its own.
+
+Usage: deduce_bench.py [options] [facts ...]
+
+The default sizes are 1000, 10000 and 100000 facts; 1000000 works but
+takes a long time.
+"""
+
+import os
+import sys
+import time
+import json
+import tempfile
+import multiprocessing
+from random import Random
+from optparse import OptionParser
+from resource import getrusage, RUSAGE_SELF
+
+from pymills.ai.deduce import brain, save_snapshot, load_snapshot
+
+
+def corpus(n, seed=0, depth=50, fanout=8, verbs=50, negations=0.1):
+    """Generate the sentences of a synthetic knowledge base
+
+    A fifth of the sentences are IS facts between kinds: half of them
+    make chains ``depth`` kinds long, and half a taxonomy where each kind
+    has ``fanout`` kinds under it.  Another fifth make instances of
+    random kinds.  The rest give kinds and instances facts about
+    ``verbs`` different verbs, with ``negations`` of them negated; a few
+    of those are IS NOT facts between kinds.  Some negated facts
+    contradict what is already known, and are refused when learned.
+
+    :param n: The number of sentences
+    :type n: int
+    :param seed: The seed for the random choices
+    :type seed: int
+    :param depth: The length of an IS chain
+    :type depth: int
+    :param fanout: The number of kinds under each kind of the taxonomy
+    :type fanout: int
+    :param verbs: The number of different verbs
+    :type verbs: int
+    :param negations: The share of the other facts that are negated
+    :type negations: float
+    :returns: A generator of sentences
+    """
+
+    random = Random(seed)
+    kinds = 0
+    instances = 0
+
+    for i in xrange(n):
+        part = i % 10
+        if part < 2 or kinds < 2:
+            kinds += 1
+            k = kinds - 1
+            if k % 2 == 0:
+                # The chains are the even kinds, linked in runs
+                chain = k // 2
+                if chain % depth == 0:
+                    yield "C%d is a T0" % k
+                else:
+                    yield "C%d is a C%d" % (k, k - 2)
+            else:
+                # The taxonomy is the odd kinds, as a tree
+                node = k // 2
+                if node == 0:
+                    yield "T0 is a THING"
+                else:
+                    yield "T%d is a T%d" % (node, (node - 1) // fanout)
+        elif part < 4:
+            instances += 1
+            yield "I%d is a %s" % (instances - 1, kind(random, kinds))
+        else:
+            if random.random() < 0.5:
+                subj = kind(random, kinds)
+            else:
+                subj = "I%d" % random.randrange(instances or 1)
+            verb = "V%d" % random.randrange(verbs)
+            obj = "O%d" % random.randrange(verbs * 10)
+            if random.random() >= negations:
+                yield "%s %s %s" % (subj, verb, obj)
+            elif part == 9 and subj[0] != "I":
+                yield "%s is not a %s" % (subj, kind(random, kinds))
+            else:
+                yield "%s doesnt %s %s" % (subj, verb, obj)
+
+
+def kind(random, kinds):
+    """Name one of the first kinds made by corpus"""
+
+    k = random.randrange(kinds)
+    if k % 2 == 0:
+        return "C%d" % k
+    else:
+        return "T%d" % (k // 2)
+
+
+def questions(n, sentences, seed=0):
+    """Make questions about a knowledge base
+
+    Half of them ask whether a word IS one of its kinds, some way up its
+    IS facts, or now and then whether it IS some unrelated word.  The
+    other half ask whether a word does what one of its kinds does, some
+    way down from the kind, so that the answer has to be worked out
+    rather than looked up.
+
+    :param n: The number of questions
+    :type n: int
+    :param sentences: The sentences of the knowledge base
+    :type sentences: list
+    :param seed: The seed for the random choices
+    :type seed: int
+    :returns: A list of questions
+    """
+
+    random = Random(seed)
+    parent = {}
+    children = {}
+    other = []
+    for s in sentences:
+        words = s.split()
+        if words[1] == "is" and words[2] == "a":
+            parent[words[0]] = words[3]
+            children.setdefault(words[3], []).append(words[0])
+        elif words[1] != "is":
+            other.append(words)
+    subjects = list(parent)
+
+    result = []
+    for i in xrange(n):
+        if i % 2 == 0 or not other:
+            word = subj = random.choice(subjects)
+            if random.random() < 0.2:
+                word = random.choice(subjects)
+            else:
+                for step in xrange(random.randrange(1, 20)):
+                    word = parent.get(word, word)
+            result.append("Is %s a %s?" % (subj, word))
+        else:
+            words = random.choice(other)
+            subj = words[0]
+            for step in xrange(random.randrange(20)):
+                if subj not in children:
+                    break
+                subj = random.choice(children[subj])
+            result.append("Does %s %s %s?" % (subj, words[-2], words[-1]))
+    return result
+
+
+def percentile(times, p):
+    """Return the p-th percentile of a sorted list"""
+
+    return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+
+
+def run(n, options):
+    """Build, question and snapshot a brain of n facts
+
+    :returns: A dict of measurements
+    """
+
+    sentences = list(corpus(n, options.seed, options.depth, options.fanout,
+                            options.verbs, options.negations))
+
+    b = brain(index=options.index, cache=0)
+    start = time.time()
+    learned, conflicts = b.learn_many(sentences, check=options.check)
+    learn_time = time.time() - start
+
+    latencies = []
+    answered = 0
+    for q in questions(options.queries, sentences, options.seed):
+        start = time.time()
+        ans = b.query(q)[0]
+        latencies.append(time.time() - start)
+        if ans != -1:
+            answered += 1
+    latencies.sort()
+
+    fd, filename = tempfile.mkstemp(suffix=".snapshot")
+    os.close(fd)
+    try:
+        save_snapshot(b, filename)
+        snapshot_size = os.path.getsize(filename)
+        start = time.time()
+        load_snapshot(filename, options.index)
+        load_time = time.time() - start
+    finally:
+        os.unlink(filename)
+
+    return {
+        "facts": n,
+        "learned": learned,
+        "refused": len(conflicts),
+        "learn_seconds": learn_time,
+        "learn_per_second": n / learn_time,
+        "queries": len(latencies),
+        "answered": answered,
+        "query_p50": percentile(latencies, 50),
+        "query_p90": percentile(latencies, 90),
+        "query_p99": percentile(latencies, 99),
+        "query_max": latencies[-1],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss": getrusage(RUSAGE_SELF).ru_maxrss * 1024,
+        "snapshot_bytes": snapshot_size,
+        "snapshot_load_seconds": load_time,
+    }
+
+
+def measure(n, options):
+    """Run one size in a new process so its peak memory is its own"""
+
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run, (n, options))
+    finally:
+        pool.terminate()
+
+
+def report(result):
+    """Print a row of the results table"""
+
+    print(
+        "{facts:>8d} {learned:>8d} {refused:>7d} {learn_per_second:>9.0f} "
+        "{p50:>8.1f} {p90:>8.1f} {p99:>8.1f} {rss:>8.1f} {load:>8.3f}".format(
+            p50=result["query_p50"] * 1e6,
+            p90=result["query_p90"] * 1e6,
+            p99=result["query_p99"] * 1e6,
+            rss=result["peak_rss"] / 1048576.0,
+            load=result["snapshot_load_seconds"],
+            **result
+        )
+    )
+    sys.stdout.flush()
+
+
+def parse_options():
+    parser = OptionParser(usage="%prog [options] [facts ...]")
+
+    parser.add_option(
+        "-s", "--seed", type="int", default=0,
+        help="Seed for the knowledge base and questions"
+    )
+    parser.add_option(
+        "-d", "--depth", type="int", default=50,
+        help="Length of each IS chain"
+    )
+    parser.add_option(
+        "-f", "--fanout", type="int", default=8,
+        help="Kinds under each kind of the taxonomy"
+    )
+    parser.add_option(
+        "-v", "--verbs", type="int", default=50,
+        help="Number of different verbs"
+    )
+    parser.add_option(
+        "-n", "--negations", type="float", default=0.1,
+        help="Share of verb facts that are negated"
+    )
+    parser.add_option(
+        "-q", "--queries", type="int", default=1000,
+        help="Number of questions to time"
+    )
+    parser.add_option(
+        "", "--no-index", action="store_false", dest="index", default=True,
+        help="Use brains without the IS index"
+    )
+    parser.add_option(
+        "", "--no-check", action="store_false", dest="check", default=True,
+        help="Learn without checking facts for consistency"
+    )
+    parser.add_option(
+        "-j", "--json", action="store_true", default=False,
+        help="Print one JSON object per size instead of a table"
+    )
+
+    opts, args = parser.parse_args()
+    return opts, [int(arg) for arg in args] or [1000, 10000, 100000]
+
+
+def main():
+    options, sizes = parse_options()
+
+    if not options.json:
+        print(
+            "{0:>8s} {1:>8s} {2:>7s} {3:>9s} {4:>8s} {5:>8s} {6:>8s} "
+            "{7:>8s} {8:>8s}".format(
+                "facts", "learned", "refused", "learn/s", "p50 us",
+                "p90 us", "p99 us", "rss MiB", "load s"
+            )
+        )
+
+    for n in sizes:
+        result = measure(n, options)
+        if options.json:
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+        else:
+            report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Deduce Memory Benchmark
+
+Measure how much resident memory a deduce brain needs per fact.
+
+Usage: deduce_memory.py [facts]
+"""
+
+import sys
+from resource import getpagesize
+
+from pymills.ai.deduce import brain
+
+
+def rss():
+    """Return the resident set size of this process
+
+    :returns: Resident memory in bytes
+    :rtype: int
+    """
+
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * getpagesize()
+
+
+def sentences(n):
+    """Generate n sentences over a small vocabulary
+
+    Words repeat the way they do in a real taxonomy: ten facts per
+    subject, a handful of verbs and a few hundred objects.
+    """
+
+    verbs = ["LIKES", "EATS", "CHASES", "HAS", "FEARS"]
+    for i in xrange(n):
+        if i % 10 == 0:
+            yield "THING%d is a KIND%d" % (i // 10, i % 300)
+        else:
+            yield "THING%d %s OBJECT%d" % (
+                i // 10, verbs[i % len(verbs)], i % 700
+            )
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    b = brain(index=0)
+    before = rss()
+    learned, conflicts = b.learn_many(sentences(n), check=0)
+    after = rss()
+
+    print("facts:          {0:d}".format(learned))
+    print("resident delta: {0:0.1f} MiB".format((after - before) / 1048576.0))
+    print("bytes per fact: {0:0.1f}".format((after - before) / float(learned)))
+
+
+if __name__ == "__main__":
+    main()
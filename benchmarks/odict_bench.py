@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Ordered Dict Benchmark
+
+Time pymills.pyodict.odict and codict against dict and
+collections.OrderedDict on inserting, looking up, testing membership,
+iterating over and deleting keys.
+
+Usage: odict_bench.py [keys]
+"""
+
+import sys
+from timeit import default_timer
+from collections import OrderedDict
+
+from pymills.pyodict import odict, codict
+
+
+def timed(f, *args):
+    """Time one call of f
+
+    :returns: The time taken in seconds
+    :rtype: float
+    """
+
+    start = default_timer()
+    f(*args)
+    return default_timer() - start
+
+
+def insert(d, keys):
+    for key in keys:
+        d[key] = key
+
+
+def lookup(d, keys):
+    for key in keys:
+        d[key]
+
+
+def contains(d, keys):
+    for key in keys:
+        key in d
+        len(d)
+
+
+def get(d, keys):
+    for key in keys:
+        d.get(key)
+
+
+def iterate(d, keys):
+    for key, value in d.iteritems():
+        pass
+
+
+def delete(d, keys):
+    for key in keys:
+        del d[key]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    keys = ["key%d" % i for i in xrange(n)]
+    kinds = (
+        ("dict", dict), ("OrderedDict", OrderedDict), ("odict", odict),
+        ("codict", codict)
+    )
+    operations = (insert, lookup, contains, get, iterate, delete)
+
+    print("{0:d} keys, microseconds per key".format(n))
+    print("{0:<12s}".format("") + "".join(
+        "{0:>10s}".format(operation.__name__) for operation in operations
+    ))
+
+    for name, kind in kinds:
+        d = kind()
+        row = []
+        for operation in operations:
+            row.append(timed(operation, d, keys) / n * 1e6)
+        print("{0:<12s}".format(name) + "".join(
+            "{0:>10.3f}".format(t) for t in row
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -42,10 +42,358 @@
 #
 #
 
+import os
 import sys
 import copy
+import socket
+import SocketServer
+import mmap
+import gc
+import json
+import multiprocessing
+import struct
+import threading
+import time
+from array import array
+from itertools import islice
+from StringIO import StringIO
+from zlib import crc32
 from string import *
 
+from pymills.pyodict import odict
+
+###########################################################################
+##
+## Searches through the brain are written as generators ("frames") that
+## are driven by brain.run from an explicit stack, rather than as
+## functions that call themselves.  A frame yields (CALL, frame) to have
+## another frame run and its result sent back, or (RETURN, value) when
+## it is finished.  This way a long chain of IS facts can't run into
+## Python's recursion limit, and a search_budget can stop a search that
+## is taking too long.  The search_budget also counts the work done, for
+## brain.stats.
+##
+###########################################################################
+CALL = 0
+RETURN = 1
+
+budget_text = "I DON'T KNOW (BUDGET EXCEEDED)"
+
+class budget_exceeded(Exception):
+    pass
+
+class search_budget:
+    ##
+    ## Initialize a budget for one question
+    ##
+    ## Inputs:
+    ##   depth: The longest chain of frames allowed, or 0 for no limit
+    ##   nodes: The most frames allowed in all, or 0 for no limit
+    ##   seconds: The most time allowed, or 0 for no limit
+    ##
+    ## Returns:
+    ##   a search_budget object
+    ##
+    def __init__(self, depth=0, nodes=0, seconds=0):
+        self.depth = depth
+        self.nodes = nodes
+
+        # What the search has done so far: the frames run, the most
+        # frames on the stack at once, and the facts copied
+        self.visited = 0
+        self.deepest = 0
+        self.copied = 0
+
+        if (seconds):
+            self.deadline = time.time() + seconds
+        else:
+            self.deadline = None
+
+    ##
+    ## Account for one more frame, raising budget_exceeded if the search
+    ## has gone past any of its limits.  The clock is only looked at
+    ## every so often, as that is the expensive part.
+    ##
+    ## Inputs:
+    ##   depth: The number of frames on the stack, including the new one
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def charge(self, depth):
+        self.visited += 1
+        if (depth > self.deepest):
+            self.deepest = depth
+        if (self.depth and depth > self.depth):
+            raise budget_exceeded("depth")
+        if (self.nodes and self.visited > self.nodes):
+            raise budget_exceeded("nodes")
+        if (self.deadline is not None and self.visited & 63 == 0
+            and time.time() > self.deadline):
+            raise budget_exceeded("time")
+
+###########################################################################
+##
+## A bounded cache of answers, thrown out least recently used first.
+## Each entry remembers the words its answer was worked out from, so
+## when the brain learns something about a word, only the entries that
+## depended on that word need to be dropped.  The cache has its own lock
+## because any number of questions may be using it at once.
+##
+###########################################################################
+class memo:
+    ##
+    ## Initialize a new cache
+    ##
+    ## Inputs:
+    ##   size: The most entries to keep
+    ##
+    ## Returns:
+    ##   a memo object
+    ##
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.clear()
+
+    ##
+    ## Drop every entry and reset the counters
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries = odict()
+            self.count = 0
+            self.depends = {}
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+        finally:
+            self.lock.release()
+
+    ##
+    ## Look up an entry, counting the hit or miss
+    ##
+    ## Inputs:
+    ##   key: The key to look up
+    ##
+    ## Returns:
+    ##   The value stored under key, or None if there isn't one
+    ##
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            try:
+                entry = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # Move it to the most recently used end
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    ##
+    ## Store an entry, throwing out the least recently used entry if the
+    ## cache is full
+    ##
+    ## Inputs:
+    ##   key: The key to store the value under
+    ##   value: The value to store (must not be None)
+    ##   depends: The words the value was worked out from
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def put(self, key, value, depends=()):
+        self.lock.acquire()
+        try:
+            self.discard(key)
+
+            while (self.count >= self.size and self.count > 0):
+                self.discard(self.entries.firstkey())
+                self.evictions += 1
+
+            depends = frozenset(depends)
+            self.entries[key] = (value, depends)
+            self.count += 1
+            for word in depends:
+                if (not self.depends.has_key(word)):
+                    self.depends[word] = set()
+                self.depends[word].add(key)
+        finally:
+            self.lock.release()
+
+    ##
+    ## Drop every entry that depends on any of the given words
+    ##
+    ## Inputs:
+    ##   words: The words that have changed
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def invalidate(self, words):
+        self.lock.acquire()
+        try:
+            for word in words:
+                keys = self.depends.get(word)
+                while (keys):
+                    self.invalidations += self.discard(keys.pop())
+        finally:
+            self.lock.release()
+
+    ##
+    ## Remove one entry.  The caller must hold the lock.
+    ##
+    ## Inputs:
+    ##   key: The entry to remove
+    ##
+    ## Returns:
+    ##   1 if there was such an entry, 0 if not
+    ##
+    def discard(self, key):
+        try:
+            (value, depends) = self.entries[key]
+        except KeyError:
+            return 0
+
+        del self.entries[key]
+        self.count -= 1
+        for word in depends:
+            keys = self.depends.get(word)
+            if (keys is not None):
+                keys.discard(key)
+                if (not keys):
+                    del self.depends[word]
+        return 1
+
+    ##
+    ## Report the cache's counters
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   A dictionary of the size, hit, miss, eviction and invalidation
+    ##   counts
+    ##
+    def stats(self):
+        self.lock.acquire()
+        try:
+            return { "size": self.count, "hits": self.hits,
+                     "misses": self.misses, "evictions": self.evictions,
+                     "invalidations": self.invalidations }
+        finally:
+            self.lock.release()
+
+###########################################################################
+##
+## A lock that lets any number of readers in at once, but gives a writer
+## the brain to itself.  Writers are preferred, so a steady stream of
+## questions can't keep new facts out forever.
+##
+###########################################################################
+class rwlock:
+    ##
+    ## Initialize a new reader/writer lock
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   an rwlock object
+    ##
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = 0
+        self.writers_waiting = 0
+
+    ##
+    ## Acquire the lock for reading, waiting for any writer to finish
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def acquire_read(self):
+        self.cond.acquire()
+        try:
+            while (self.writer or self.writers_waiting):
+                self.cond.wait()
+            self.readers += 1
+        finally:
+            self.cond.release()
+
+    ##
+    ## Release a read lock
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def release_read(self):
+        self.cond.acquire()
+        try:
+            self.readers -= 1
+            if (self.readers == 0):
+                self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    ##
+    ## Acquire the lock for writing, waiting for all readers and any
+    ## other writer to finish
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def acquire_write(self):
+        self.cond.acquire()
+        try:
+            self.writers_waiting += 1
+            while (self.writer or self.readers):
+                self.cond.wait()
+            self.writers_waiting -= 1
+            self.writer = 1
+        finally:
+            self.cond.release()
+
+    ##
+    ## Release a write lock
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def release_write(self):
+        self.cond.acquire()
+        try:
+            self.writer = 0
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
 class sentence:
     adjectives = [ "A", "AN", "THE", "ALL", "EVERY", "NONE", "MY", "YOUR" ]
     negatives = [ "NO", "NONE", "NOT", "CANNOT", "CANT", "WONT",
@@ -84,12 +432,13 @@ class sentence:
         # Break the sentence into individual words
         self.words = []
         
-        # Expand any contractions
+        # Expand any contractions.  Words are interned, so every fact
+        # and brain entry that mentions a word shares a single copy of it.
         for word in string.split():
             if (word in self.contractions):
                 self.words += self.contractions[word]
             else:
-                self.words.append(word)
+                self.words.append(intern(word))
 
         self.index = 0
 
@@ -239,6 +588,140 @@ class sentence:
         else:
             return 0
 
+###########################################################################
+##
+## A quicker way to break a sentence into phrases, for fact.translate.
+## It gives exactly the phrases sentence.next_phrase would, but looks
+## words up in tables built once from the sentence class and goes
+## through the words a single time.
+##
+###########################################################################
+punctuation = ".?!,'\n\r\t"
+
+# What each special word is to the parser.  A word in more than one of
+# the sentence class's lists is whatever next_phrase checks for first.
+word_kinds = {}
+for (kind, words) in (("verb", sentence.verbs),
+                      ("helping verb", sentence.helping_verbs),
+                      ("adjective", sentence.adjectives),
+                      ("negative", sentence.negatives)):
+    for word in words:
+        word_kinds[word] = kind
+del kind, words, word
+
+question_words = frozenset(sentence.verbs + sentence.helping_verbs)
+
+contraction_words = {}
+for (word, words) in sentence.contractions.items():
+    contraction_words[word] = tuple(words)
+del word, words
+
+##
+## Break a sentence into phrases
+##
+## Inputs:
+##   statement: The sentence in string format
+##
+## Returns:
+##   A list containing two items:
+##     1 if the sentence is a question, otherwise 0
+##     A list of phrases, ending with the "eol" phrase.  Each phrase is a
+##     tuple of the type, adjective, helping verb, primary word, number of
+##     negatives and error message (or None) that next_phrase gives.
+##     A sentence with no words is a lone "eol" phrase with an error.
+##
+def parse(statement):
+    words = []
+    kinds = []
+    for word in statement.upper().translate(None, punctuation).split():
+        expansion = contraction_words.get(word)
+        if (expansion is None):
+            words.append(intern(word))
+            kinds.append(word_kinds.get(word))
+        else:
+            for word in expansion:
+                words.append(word)
+                kinds.append(word_kinds.get(word))
+
+    # Nothing is left of a sentence that is only punctuation
+    if (len(words) == 0):
+        return [ 0, [("eol", "", "", "", 0, "I DON'T UNDERSTAND")] ]
+
+    if (words[0] in question_words):
+        question = 1
+    else:
+        question = 0
+
+    # A sentence can end with negatives, which the last phrase takes
+    kinds.append(None)
+
+    phrases = []
+    i = 0
+    n = len(words)
+    while (1):
+        negative = 0
+        while (kinds[i] == "negative"):
+            negative += 1
+            i += 1
+        if (i == n):
+            phrases.append(("eol", "", "", "", negative, None))
+            return [ question, phrases ]
+
+        word = words[i]
+        word_kind = kinds[i]
+        i += 1
+        if (word_kind is None):
+            kind = "unknown"
+            adj = helping_verb = ""
+            primary = word
+        elif (word_kind == "verb"):
+            kind = "verb"
+            adj = helping_verb = ""
+            primary = word
+        elif (word_kind == "helping verb" and question):
+            kind = "helping verb"
+            adj = primary = ""
+            helping_verb = word
+        else:
+            if (word_kind == "adjective"):
+                kind = "noun phrase"
+                adj = word
+                helping_verb = ""
+            else:
+                kind = "verb phrase"
+                adj = ""
+                helping_verb = word
+
+            # Expecting a primary word
+            while (kinds[i] == "negative"):
+                negative += 1
+                i += 1
+            if (i == n):
+                phrases.append((kind, adj, helping_verb, None, negative,
+                                "Unexpected end of sentence"))
+                continue
+            word = words[i]
+            word_kind = kinds[i]
+            i += 1
+            if (word_kind == "adjective" or word_kind == "helping verb"):
+                error = "Unexpected word \""+word+"\""
+                primary = ""
+            else:
+                error = None
+                primary = word
+
+            while (kinds[i] == "negative"):
+                negative += 1
+                i += 1
+            phrases.append((kind, adj, helping_verb, primary, negative, error))
+            continue
+
+        # Negatives after a phrase belong to it
+        while (kinds[i] == "negative"):
+            negative += 1
+            i += 1
+        phrases.append((kind, adj, helping_verb, primary, negative, None))
+
 ###########################################################################
 ##
 ## A fact is a single piece of information.  It's what is stored in
@@ -246,18 +729,11 @@ class sentence:
 ## class is used to store and print individual facts.
 ##
 ###########################################################################
-class fact:
-    # Class members
-    subj_adj     = ""
-    subj         = ""
-    helping_verb = ""
-    verb         = ""
-    orig_verb    = ""
-    obj_adj      = ""
-    obj          = ""
-    question     = 0
-    negative     = 0
-    seen         = 0
+class fact(object):
+    # Instance members.  A brain can hold millions of facts, so they
+    # live in slots rather than a per-instance dictionary.
+    __slots__ = ( "subj_adj", "subj", "helping_verb", "verb", "orig_verb",
+                  "obj_adj", "obj", "question", "negative", "error" )
 
     to_be = [ "IS", "ARE", "AM", "BE", "WAS", "WERE" ]
 
@@ -271,8 +747,70 @@ class fact:
     ##   a fact object
     ##
     def __init__(self, statement):
-        if (statement != ""):
+        self.subj_adj     = ""
+        self.subj         = ""
+        self.helping_verb = ""
+        self.verb         = ""
+        self.orig_verb    = ""
+        self.obj_adj      = ""
+        self.obj          = ""
+        self.question     = 0
+        self.negative     = 0
+        self.error        = ""
+
+        if (statement == ""):
+            return
+
+        # Sentences seen before are copied from the parse cache, if there
+        # is one (see cache_parses), rather than translated again
+        if (parse_cache is None):
+            self.translate(statement)
+            return
+
+        template = parse_cache.get(statement)
+        if (template is None):
             self.translate(statement)
+            parse_cache.put(statement, self.__getstate__())
+        else:
+            (self.subj_adj, self.subj, self.helping_verb, self.verb,
+             self.orig_verb, self.obj_adj, self.obj, self.question,
+             self.negative, self.error) = template
+
+    ##
+    ## Copy a fact.  All the members are strings or numbers, so a
+    ## shallow copy is also a deep one.
+    ##
+    ## Inputs:
+    ##   memo: Ignored; present for copy.deepcopy
+    ##
+    ## Returns:
+    ##   A new fact with the same members
+    ##
+    def __copy__(self, memo=None):
+        newfact = fact.__new__(fact)
+        newfact.subj_adj = self.subj_adj
+        newfact.subj = self.subj
+        newfact.helping_verb = self.helping_verb
+        newfact.verb = self.verb
+        newfact.orig_verb = self.orig_verb
+        newfact.obj_adj = self.obj_adj
+        newfact.obj = self.obj
+        newfact.question = self.question
+        newfact.negative = self.negative
+        newfact.error = self.error
+        return newfact
+
+    __deepcopy__ = __copy__
+
+    ##
+    ## Support for pickle, which can't see slots on its own
+    ##
+    def __getstate__(self):
+        return tuple([ getattr(self, name) for name in self.__slots__ ])
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
 
     ##
     ## Output a fact as a string
@@ -318,141 +856,105 @@ class fact:
     ##   none
     ##
     def translate(self, statement):
-         sent = sentence(statement)
          state = 0
-         self.question = sent.is_question()
+         [ self.question, phrases ] = parse(statement)
          self.error = ""
-         phrase = sent.next_phrase()
 
-         while (phrase["error"] == None and phrase["type"] != "eol"):
-             self.negative += phrase["negative"]
+         for (kind, adj, helping_verb, primary, negative, error) in phrases:
+             if (kind == "eol"):
+                 if (error is not None):
+                     self.error = error
+                 break
+             if (error is not None):
+                 break
+
+             self.negative += negative
 
              if (state == 0):
-                 if (phrase["type"] == "unknown" or
-                     phrase["type"] == "noun phrase"):
-                     self.subj_adj = phrase["adj"]
-                     self.subj = phrase["primary"]
+                 if (kind == "unknown" or kind == "noun phrase"):
+                     self.subj_adj = adj
+                     self.subj = primary
                      state = 1 
-                 elif (phrase["type"] == "verb"):
-                     self.orig_verb = phrase["primary"]
-                     if (phrase["primary"] in self.to_be):
+                 elif (kind == "verb"):
+                     self.orig_verb = primary
+                     if (primary in to_be_words):
                          self.verb = "IS"
                      else:
-                         self.verb = phrase["primary"]
+                         self.verb = primary
                      state = 3
-                 elif (phrase["type"] == "helping verb"):
-                     self.helping_verb = phrase["helping_verb"]
+                 elif (kind == "helping verb"):
+                     self.helping_verb = helping_verb
                      state = 5
                  else:
                      self.error = "I DON'T UNDERSTAND"
                      state = 99
 
              elif (state == 1):
-                 self.orig_verb = phrase["primary"]
+                 self.orig_verb = primary
                  
-                 if (phrase["type"] == "verb"):
+                 if (kind == "verb"):
                      # Treat forms of "to be" specially
-                     if (phrase["primary"] in self.to_be):
+                     if (primary in to_be_words):
                          self.verb = "IS"
                      else:
-                         self.verb = phrase["primary"]
+                         self.verb = primary
                      state = 2
-                 elif (phrase["type"] == "verb phrase"):
+                 elif (kind == "verb phrase"):
                      # Treat forms of "to be" specially
-                     if (phrase["primary"] in self.to_be):
-                         self.helping_verb = phrase["helping_verb"]
+                     self.helping_verb = helping_verb
+                     if (primary in to_be_words):
                          self.verb = "IS"
                      else:
-                         self.helping_verb = phrase["helping_verb"]
-                         self.verb = phrase["primary"]
+                         self.verb = primary
                      state = 2
-                 elif (phrase["type"] == "unknown"):
-                     self.verb = phrase["primary"]
+                 elif (kind == "unknown"):
+                     self.verb = primary
                      state = 2
                  else:
                      self.error = "I DON'T UNDERSTAND"
                      state = 99
 
-             elif (state == 2):
-                 if (phrase["type"] == "unknown"):
-                     self.obj = phrase["primary"]
+             elif (state == 2 or state == 4 or state == 7):
+                 if (kind == "unknown"):
+                     self.obj = primary
                      state = 99
-                 elif (phrase["type"] == "noun phrase"):
-                     self.obj_adj = phrase["adj"]
-                     self.obj = phrase["primary"]
+                 elif (kind == "noun phrase"):
+                     self.obj_adj = adj
+                     self.obj = primary
                      state = 99
                  else:
                      self.error = "I DON'T UNDERSTAND"
                      state = 99
 
-             elif (state == 3):
-                 if (phrase["type"] == "unknown"):
-                     self.subj = phrase["primary"]
-                     state = 4
-                 elif (phrase["type"] == "noun phrase"):
-                     self.subj_adj = phrase["adj"]
-                     self.subj = phrase["primary"]
-                     state = 4
-                 else:
-                     self.error = "I DON'T UNDERSTAND"
-                     state = 99
-
-             elif (state == 4):
-                 if (phrase["type"] == "unknown"):
-                     self.obj = phrase["primary"]
-                     state = 99
-                 elif (phrase["type"] == "noun phrase"):
-                     self.obj_adj = phrase["adj"]
-                     self.obj = phrase["primary"]
-                     state = 99
+             elif (state == 3 or state == 5):
+                 if (kind == "unknown"):
+                     self.subj = primary
+                 elif (kind == "noun phrase"):
+                     self.subj_adj = adj
+                     self.subj = primary
                  else:
                      self.error = "I DON'T UNDERSTAND"
                      state = 99
-
-             elif (state == 5):
-                 if (phrase["type"] == "unknown"):
-                     self.subj = phrase["primary"]
-                     state = 6
-                 elif (phrase["type"] == "noun phrase"):
-                     self.subj_adj = phrase["adj"]
-                     self.subj = phrase["primary"]
+                 if (state == 3):
+                     state = 4
+                 elif (state == 5):
                      state = 6
-                 else:
-                     self.error = "I DON'T UNDERSTAND"
-                     state = 99
                  
              elif (state == 6):
-                 if (phrase["type"] == "unknown"):
-                     self.orig_verb = phrase["primary"]
-                     if (phrase["primary"] in self.to_be):
+                 if (kind == "unknown"):
+                     self.orig_verb = primary
+                     if (primary in to_be_words):
                          self.verb = "IS"
                      else:
-                         self.verb = phrase["primary"]
+                         self.verb = primary
                      state = 7
                  else:
                      self.error = "I DON'T UNDERSTAND"
                      state = 99
 
-             elif (state == 7):
-                 if (phrase["type"] == "eol"):
-                     state = 99
-                 elif (phrase["type"] == "unknown"):
-                     self.obj = phrase["primary"]
-                     state = 99
-                 elif (phrase["type"] == "noun phrase"):
-                     self.obj_adj = phrase["adj"]
-                     self.obj = phrase["primary"]
-                     state = 99
-                 else:
-                     self.error = "I DON'T UNDERSTAND"
-                     state = 99
-
              elif (state == 99):
                  self.error = "THE SENTENCE IS TOO LONG"
 
-             phrase = sent.next_phrase()
-             
-
          if (self.error == ""):
              if (self.negative > 1):
                  self.error = "DON'T GIVE ME NO DOUBLE NEGATIVES"
@@ -518,6 +1020,31 @@ class fact:
         return newfact
         
     
+to_be_words = frozenset(fact.to_be)
+
+# The parse cache used by fact, or None
+parse_cache = None
+
+##
+## Turn the parse cache on or off.  While it is on, the fields of the
+## facts made from the most recently used sentences are remembered, so
+## making a fact from the same sentence again doesn't parse it again.
+## The cache's stats method reports its hits, misses and evictions.
+##
+## Inputs:
+##   size: The number of sentences to remember, or 0 to turn it off
+##
+## Returns:
+##   The new parse cache (a memo object), or None
+##
+def cache_parses(size):
+    global parse_cache
+    if (size):
+        parse_cache = memo(size)
+    else:
+        parse_cache = None
+    return parse_cache
+
 ######################################################################
 ##
 ## The brain is ... well ... the brains of the operation.  It's
@@ -532,16 +1059,80 @@ class brain:
     ## Initialize a new brain object
     ##
     ## Inputs:
-    ##   none
+    ##   index: If true (the default), maintain a transitive closure of
+    ##          the positive IS facts so "IS" questions can be answered
+    ##          without walking the whole graph.  If false, every question
+    ##          is answered by the plain recursive search.
+    ##   cache: The number of answers to remember, or 0 to remember none
+    ##
+    ## The search for each question (or for the check made when learning
+    ## a fact) can be limited by setting max_depth (the longest chain of
+    ## IS facts followed), max_nodes (the most subjects looked at) and
+    ## time_limit (in seconds).  A question that runs past a limit is
+    ## answered "I DON'T KNOW (BUDGET EXCEEDED)".  learn_many checks each
+    ## fact within batch_nodes subjects when max_nodes is 0, so a load
+    ## can't be held up by one fact that takes a long search to check.
+    ##
+    ## Setting shortest makes query find the shortest reason it can for
+    ## the answer to an "IS" question, rather than the first one found.
+    ## proof_limit, if not 0, is the most facts such a reason may take.
     ##
     ## Returns:
     ##   a brain object
     ##
-    def __init__(self):
+    def __init__(self, index=1, cache=10000):
+        # brain_verb and brain_obj count the facts using each verb and
+        # object
         self.brain = {}
         self.brain_verb = {}
         self.brain_obj = {}
 
+        # The IS-A reachability index.  is_up maps a word to the set of
+        # words it reaches through positive IS facts, is_down is the
+        # inverse of is_up, and is_into maps a word to the set of
+        # subjects with an IS fact (positive or negative) pointing at it.
+        self.index = index
+        self.is_up = {}
+        self.is_down = {}
+        self.is_into = {}
+
+        # The reverse index maps an object to a dictionary from each verb
+        # used with it to the set of subjects of those facts
+        self.reverse = {}
+
+        # Queries share the brain, learning needs it to itself
+        self.lock = rwlock()
+
+        # Everything learned is also appended here, if it is set
+        self.journal = None
+
+        # Limits on the search for any one question; 0 is no limit
+        self.max_depth = 0
+        self.max_nodes = 0
+        self.time_limit = 0
+        self.batch_nodes = 10000
+
+        # Whether to look for the shortest reason for an answer
+        self.shortest = 0
+        self.proof_limit = 0
+
+        # While instrument is set, the work done by each learn, query and
+        # describe_subj is added up (see stats), and each of the hooks is
+        # called as hook(operation, fact, search_budget, seconds)
+        self.instrument = 0
+        self.hooks = []
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+        # Answers to recent questions, and the attributes of recently
+        # asked about subjects
+        if (cache):
+            self.answers = memo(cache)
+            self.attrs = memo(cache)
+        else:
+            self.answers = None
+            self.attrs = None
+
     ##
     ## Convert a brain object into a string.  This is done by
     ## outputting a list of all the facts contained within the
@@ -554,14 +1145,89 @@ class brain:
     ##   A string containing all the facts, separated by newlines
     ##
     def __str__(self):
-        out = ""
-        for s in self.brain.keys():
-            for v in self.brain[s].keys():
-                for o in self.brain[s][v].keys():
-                    if (s != o or v != "IS"):
-                        out = out + self.brain[s][v][o].__str__() + "\n"
+        self.lock.acquire_read()
+        try:
+            return join([ f.__str__() + "\n"
+                          for verbs in self.brain.itervalues()
+                          for objects in verbs.itervalues()
+                          for f in objects.itervalues()
+                          if (f.subj != f.obj or f.verb != "IS") ], "")
+        finally:
+            self.lock.release_read()
+
+    ##
+    ## Go through every fact in the brain a chunk at a time.  The brain
+    ## is only locked while each chunk is gathered, never while it is
+    ## being used, so a slow reader holds up nobody else.  Each chunk
+    ## comes from a single moment, but facts learned or forgotten
+    ## between chunks may or may not be given.
+    ##
+    ## Inputs:
+    ##   chunk: The number of facts to gather at a time (a subject's
+    ##          facts are never split, so a chunk may be larger)
+    ##
+    ## Returns:
+    ##   A generator of lists of facts
+    ##
+    def iterchunks(self, chunk=1000):
+        self.lock.acquire_read()
+        try:
+            subjects = self.brain.keys()
+        finally:
+            self.lock.release_read()
+
+        i = 0
+        while (i < len(subjects)):
+            facts = []
+            self.lock.acquire_read()
+            try:
+                while (i < len(subjects) and len(facts) < chunk):
+                    verbs = self.brain.get(subjects[i])
+                    i += 1
+                    if (verbs is None):
+                        # Forgotten since the list was made
+                        continue
+                    for objects in verbs.itervalues():
+                        facts.extend(objects.itervalues())
+            finally:
+                self.lock.release_read()
+            if (facts):
+                yield facts
 
-        return out
+    ##
+    ## Go through every fact in the brain, as iterchunks gathers them
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   A generator of facts
+    ##
+    def iterfacts(self):
+        for facts in self.iterchunks():
+            for f in facts:
+                yield f
+
+    ##
+    ## Write out all the facts in the brain, as __str__ gives them, a
+    ## chunk at a time, so even a very large brain never has to be held
+    ## in memory as text.  Nothing is written with the brain locked.
+    ##
+    ## Inputs:
+    ##   out: The file to write to
+    ##   chunk: The number of facts to write at a time
+    ##
+    ## Returns:
+    ##   The number of facts written
+    ##
+    def write_facts(self, out, chunk=1000):
+        count = 0
+        for facts in self.iterchunks(chunk):
+            lines = [ f.__str__() + "\n" for f in facts
+                      if (f.subj != f.obj or f.verb != "IS") ]
+            out.write(join(lines, ""))
+            count += len(lines)
+        return count
 
     ##
     ## Learn is used to teach something to the brain.  If the information
@@ -581,8 +1247,36 @@ class brain:
         if (type(newfact) == type("")):
             newfact = fact(newfact)
 
-        # Make sure the fact has no errors
-        if (newfact.error != ""):
+        if (not self.instrument):
+            self.lock.acquire_write()
+            try:
+                return self.learn_unlocked(newfact)
+            finally:
+                self.lock.release_write()
+
+        budget = self.budget()
+        start = time.time()
+        self.lock.acquire_write()
+        try:
+            result = self.learn_unlocked(newfact, budget)
+        finally:
+            self.lock.release_write()
+        self.record("learn", newfact, budget, time.time() - start)
+        return result
+
+    ##
+    ## The body of learn, for callers already holding the write lock
+    ##
+    ## Inputs:
+    ##   newfact: A fact containing the information to add
+    ##   budget: If not None, the search_budget for checking the fact
+    ##
+    ## Returns:
+    ##   The same as learn
+    ##
+    def learn_unlocked(self, newfact, budget=None):
+        # Make sure the fact has no errors
+        if (newfact.error != ""):
             return [ newfact.error,[] ]
 
         # Refuse anything that says something is not itself
@@ -590,12 +1284,38 @@ class brain:
             return [ "I'M NOT BUYING IT", [] ]
 
         # Query to make sure this is a new fact
-        [ stat, str, reason ] = self.query(newfact)
-        if (stat == 0):
+        [ stat, str, reason ] = self.query_unlocked(newfact, None, 0, budget)
+        if (str == budget_text):
+            return [ str, [] ]
+        elif (stat == 0):
             return [ "THAT CAN'T BE RIGHT", reason ]
         elif (stat == 1):
             return [ "YEAH, I KNOW", reason ]
-            
+
+        result = self.store(newfact)
+        if (result is not None):
+            return result
+
+        if (self.journal is not None):
+            self.journal.append("+", newfact)
+
+        if (newfact.subj == newfact.obj):
+            return [ "WELL, OK", [] ]
+        else:
+            return [ "OK", [] ]
+
+    ##
+    ## Store a fact in the brain without checking whether it can already
+    ## be deduced.  The caller must hold the write lock.
+    ##
+    ## Inputs:
+    ##   newfact: The fact to store
+    ##
+    ## Returns:
+    ##   None if the fact was stored, otherwise a list containing a
+    ##   status message and the fact that is already stored in its place
+    ##
+    def store(self, newfact):
         # Insert the subject
         if (not self.brain.has_key(newfact.subj)):
             self.brain[newfact.subj] = {}
@@ -618,425 +1338,2814 @@ class brain:
         else:
             self.brain[newfact.subj][newfact.verb][newfact.obj] = newfact
 
-        # Store the verb and object for future reference
-        if (not self.brain_verb.has_key(newfact.verb)):
-            self.brain_verb[newfact.verb] = 1
+        # Count the verb and object for future reference
+        newverb = not self.brain_verb.has_key(newfact.verb)
+        self.brain_verb[newfact.verb] = self.brain_verb.get(newfact.verb, 0) + 1
 
-        # Also store the object
-        if (newfact.obj != "" and not self.brain_obj.has_key(newfact.obj)):
-            self.brain_obj[newfact.obj] = 1
+        # Also count the object
+        if (newfact.obj != ""):
+            self.brain_obj[newfact.obj] = self.brain_obj.get(newfact.obj, 0) + 1
 
-        if (newfact.subj == newfact.obj):
-            return [ "WELL, OK", [] ]
-        else:
-            return [ "OK", [] ]
+        # Keep the indexes up to date
+        self.reverse_fact(newfact)
+        if (self.index and newfact.verb == "IS"):
+            self.index_fact(newfact)
+
+        # Forget any answers that might have changed
+        if (self.answers is not None):
+            if (self.index):
+                words = self.affected(newfact.subj)
+                words.add(newfact.obj)
+                if (newverb):
+                    words.add(("VERB", newfact.verb))
+                self.answers.invalidate(words)
+                self.attrs.invalidate(words)
+            else:
+                self.answers.clear()
+                self.attrs.clear()
+
+        return None
 
     ##
-    ## Return a list of facts relating to a particular subject.  This
-    ## list will include items determined deductively.
+    ## Forget a fact.  Only the fact itself is forgotten: anything that
+    ## was learned because of it stays.
     ##
     ## Inputs:
-    ##   subject: The subject we want to describe
+    ##   oldfact: A fact or string containing the information to remove
     ##
     ## Returns:
-    ##   A list of facts about the given subject
+    ##   A list containing two items:
+    ##     A string with a status message
+    ##     A list containing the fact forgotten, if there was one
     ##
-    def describe_subj(self, subject):
-        subject = upper(subject)
-        dfact = fact("")
-        symmetry = fact(subject+" is "+subject)
-        desc = [ symmetry ]
+    def forget(self, oldfact):
+        # Translate the fact from a string to a true fact if necessary
+        if (type(oldfact) == type("")):
+            oldfact = fact(oldfact)
 
-        if (not self.brain.has_key(subject)):
-            return desc
+        if (oldfact.error != ""):
+            return [ oldfact.error, [] ]
 
-        for verb in self.brain[subject]:
-            for object in self.brain[subject][verb]:
-                dfact = copy.deepcopy(self.brain[subject][verb][object])
+        self.lock.acquire_write()
+        try:
+            f = self.unstore(oldfact)
+            if (f is None):
+                return [ "I DIDN'T KNOW THAT", [] ]
 
-                if (dfact.seen == 0):
-                    desc.append(dfact)
+            if (self.journal is not None):
+                self.journal.append("-", f)
+            return [ "FORGOTTEN", [ f ] ]
+        finally:
+            self.lock.release_write()
 
-                    if (not dfact.verb in self.to_be):
-                        if (dfact.obj != ".fact" and not dfact.negative):
-                            dfact.obj = ""
-                            dfact.obj_adj = ""
-                            desc.append(dfact)
-                    elif (not dfact.negative):
-                        if (object == ".fact"):
-                            newsubj = dfact.verb
-                        else:
-                            newsubj = dfact.obj
+    ##
+    ## Remove a fact from the brain, undoing what store did.  The work
+    ## done is in proportion to the number of words that are (directly or
+    ## through other words) the fact's subject, not to the brain's size.
+    ## The caller must hold the write lock.
+    ##
+    ## Inputs:
+    ##   oldfact: A fact like the one to remove
+    ##
+    ## Returns:
+    ##   The fact removed, or None if the brain didn't have it
+    ##
+    def unstore(self, oldfact):
+        subj = oldfact.subj
+        verb = oldfact.verb
+        obj = oldfact.obj or ".fact"
 
-                        # Now, recursively look for more entries
-                        self.brain[subject][verb][object].seen = 1
-                        desc2 = self.describe_subj(newsubj)
-                        self.brain[subject][verb][object].seen = 0
+        verbs = self.brain.get(subj)
+        if (verbs is None or not verbs.has_key(verb)
+            or not verbs[verb].has_key(obj)):
+            return None
+        f = verbs[verb][obj]
+        if (f.negative != oldfact.negative):
+            return None
 
-                        # Convert the subject of each fact
-                        for index in xrange(0,len(desc2)):
-                            desc2[index].subj_adj = dfact.subj_adj
-                            desc2[index].subj = dfact.subj
+        # The answers to forget have to be worked out while the index
+        # still has the fact in it
+        if (self.answers is not None and self.index):
+            words = self.affected(subj)
+            words.add(obj)
 
-                        desc += desc2
-                        del desc2
+        del verbs[verb][obj]
+        if (not verbs[verb]):
+            del verbs[verb]
+            if (not verbs):
+                del self.brain[subj]
 
-        return desc
+        self.brain_verb[verb] -= 1
+        goneverb = (self.brain_verb[verb] == 0)
+        if (goneverb):
+            del self.brain_verb[verb]
+        self.brain_obj[obj] -= 1
+        if (self.brain_obj[obj] == 0):
+            del self.brain_obj[obj]
+
+        subjects = self.reverse[obj][verb]
+        subjects.discard(subj)
+        if (not subjects):
+            del self.reverse[obj][verb]
+            if (not self.reverse[obj]):
+                del self.reverse[obj]
+
+        if (self.index and verb == "IS"):
+            self.unindex_fact(f)
+
+        if (self.answers is not None):
+            if (self.index and not goneverb):
+                self.answers.invalidate(words)
+                self.attrs.invalidate(words)
+            else:
+                # Without the index, or once nothing uses the verb, any
+                # answer might have changed
+                self.answers.clear()
+                self.attrs.clear()
+
+        return f
 
     ##
-    ## Ask a yes/no question to a brain.  The brain will recursively
-    ## search for an answer based on the facts it knows
+    ## Work out which words an answer might have depended on for the
+    ## answer to change now that something about a word has changed:
+    ## the word itself and everything that is (transitively) one.
     ##
     ## Inputs:
-    ##   question: The question to ask
+    ##   word: The word that has changed
     ##
     ## Returns:
-    ##   A number detailing the answerm, a string containing the answer, and
-    ##   a list of facts detailing the reason for the answer (assuming the
-    ##   answer isn't "I don't know")
+    ##   A set of words
     ##
-    def query(self, question):
-        # Translate the question from a string to a fact if necessary
-        if (type(question) == type("")):
-            question = fact(question)
+    def affected(self, word):
+        words = set(self.is_down.get(word, ()))
+        words.add(word)
+        return words
 
-        # Simple checks
-        if (not self.brain.has_key(question.subj)
-            and not self.brain_obj.has_key(question.subj)):
-            
-            return [ -1, "WHAT'S THIS \""+question.subj+"\" THING?", [] ]
-
-        if (question.obj != ""
-            and not self.brain.has_key(question.obj)
-            and not self.brain_obj.has_key(question.obj)):
-            
-            return [ -1, "WHAT'S THIS \""+question.obj+"\" THING?", [] ]
+    ##
+    ## Forget everything the brain knows
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def clear(self):
+        self.replace(brain(self.index, 0))
 
-        if (question.verb != "IS"):
-            if (not self.brain_verb.has_key(question.verb)):
-                return [ -1, "I DON'T KNOW WHAT IT MEANS TO "+question.verb, [] ]
+    ##
+    ## Replace everything the brain knows with what another brain knows,
+    ## for questions already in progress to see one or the other.  The
+    ## other brain is taken over rather than copied, so it mustn't be
+    ## used afterwards.
+    ##
+    ## Inputs:
+    ##   other: The brain to take the facts from
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def replace(self, other):
+        self.lock.acquire_write()
+        try:
+            self.brain = other.brain
+            self.brain_verb = other.brain_verb
+            self.brain_obj = other.brain_obj
+            self.reverse = other.reverse
 
-        if (question.subj == question.obj and question.verb == "IS"):
-            if (question.negative == 0):
-                return [ 1, "DUH, YES", [question] ]
+            if (other.index == self.index):
+                self.is_up = other.is_up
+                self.is_down = other.is_down
+                self.is_into = other.is_into
             else:
-                return [ 0, "UGH, NO", [question] ]
-        
-        # Ask the question
-        [ans,reason] = self.query_i(question)
+                self.is_up = {}
+                self.is_down = {}
+                self.is_into = {}
+                if (self.index):
+                    for verbs in self.brain.values():
+                        for f in verbs.get("IS", {}).values():
+                            self.index_fact(f)
 
-        if (ans == 0):
-            question.negative = 1 - question.negative
-            return [ 0, "NO, "+question.swap_person().__str__(), reason ]
-        elif (ans == 1):
-            return [ 1, "YES, "+question.swap_person().__str__(), reason ]
+            if (self.answers is not None):
+                self.answers.clear()
+                self.attrs.clear()
 
-        # More checking is necessary here, just to be sure.
-        # Get a list of every attribute of both the subject and object.
-        if (question.obj != "" and question.verb == "IS"):
-            subject_attr = self.describe_subj(question.subj)
-            object_attr = self.describe_subj(question.obj)
-
-            for f in subject_attr:
-                f2 = copy.copy(f)
-                f2.subj = question.obj
-                f2.subj_adj = question.obj_adj
-                [ans,reason] = self.query_i(f2)
-                if (ans == 0):
-                    # Grab the reason for the fact f
-                    [ans,reason0] = self.query_i(f)
-                    reason = reason0 + reason
-
-                    if (question.negative == 0):
-                        question.negative = 1 - question.negative
-                        return [ 0, "NO, "+question.swap_person().__str__(), reason ]
-                    else :
-                        return [ 1, "YES, "+question.swap_person().__str__(), reason ]
-
-            for f in object_attr:
-                f2 = copy.copy(f)
-                f2.subj = question.subj
-                f2.subj_adj = question.subj_adj
-                [ans,reason] = self.query_i(f2)
-                if (ans == 0):
-                    # Grab the reason for the fact f
-                    [ans,reason0] = self.query_i(f)
-                    reason = reason0 + reason
-                    
-                    if (question.negative == 0):
-                        question.negative = 1 - question.negative
-                        return [ 0, "NO, "+question.swap_person().__str__(), reason ]
-                    else :
-                        return [ 1, "YES, "+question.swap_person().__str__(), reason ]
+            if (self.journal is not None):
+                self.journal.append("*", fact(""))
+                for verbs in self.brain.values():
+                    for objects in verbs.values():
+                        for f in objects.values():
+                            self.journal.append("+", f)
+        finally:
+            self.lock.release_write()
 
-        return [ -1, "I DON'T KNOW", [] ]
-    
     ##
-    ## Internal function for asking a question.  This is where the real
-    ## processing takes place.
+    ## Teach the brain a whole stream of facts at once.  Sentences are
+    ## parsed a batch at a time, outside the lock, and then checked and
+    ## stored in one pass, with nothing printed.  A fact the IS-A index
+    ## shows nothing can be known about (see may_know) is stored without
+    ## a search; the others are checked with a single query each, within
+    ## batch_nodes subjects unless max_nodes is set.  Otherwise the brain
+    ## ends up as if each sentence had been given to learn in turn: a
+    ## fact that contradicts what the brain already knows is reported,
+    ## and one that can already be deduced is quietly dropped.  A line
+    ## that can't be parsed or checked is reported too, and the rest are
+    ## still learned.  The write lock is only held while a batch is being
+    ## checked and stored, so questions can still be answered during a
+    ## long load.
     ##
     ## Inputs:
-    ##   q: The question to ask (must be a class fact)
+    ##   sentences: An iterable of strings or facts, one per line
+    ##   check: If false, trust the input and skip the consistency
+    ##          check altogether
+    ##   batch: The number of sentences parsed and stored per batch
     ##
     ## Returns:
-    ##   A list containing two values.  The first is:
-    ##     -1: I don't know
-    ##      0: No
-    ##      1: Yes
-    ##   and the second is a list of facts detailing the the reason for
-    ##   the decision.  If the answer is -1, the list will be empty.
+    ##   A list containing two items:
+    ##     The number of facts learned
+    ##     A list of the sentences that were not learned, each a list
+    ##     containing the line number, the sentence, a status message,
+    ##     and a list of facts detailing the reason
     ##
-    def query_i(self, q):
-        # Look for the question's subject in the brain
-        if (not self.brain.has_key(q.subj)):
-            return [ -1, [] ]
+    def learn_many(self, sentences, check=1, batch=1000):
+        learned = 0
+        conflicts = []
+        lines = []
+        lineno = 0
 
-        # If the question's verb is of the form "to be" we handle it like this
-        if (q.verb == "IS"):
-            if (q.subj == q.obj):
-                # We can safely say an object is itself
-                return [ 1, [q] ]
-            if (self.brain[q.subj].has_key(q.verb)):
-                # Found a match in the brain.  We can answer definitively
-                # yes(1) or no(0)
-                if (self.brain[q.subj][q.verb].has_key(q.obj)):
-                    ans = self.brain[q.subj][q.verb][q.obj].negative
+        for line in sentences:
+            lineno += 1
+            lines.append((lineno, line))
+            if (len(lines) >= batch):
+                learned += self.learn_batch(lines, conflicts, check)
+                lines = []
 
-                    if (q.negative == 0):
-                        ans = 1 - ans
+        if (lines):
+            learned += self.learn_batch(lines, conflicts, check)
 
-                    return [ ans,[self.brain[q.subj][q.verb][q.obj]] ]
-                else:
-                    # Didn't find a definitive answer.  Look for it
-                    # recursively
-                    for obj in self.brain[q.subj][q.verb]:
-                        if (self.brain[q.subj][q.verb][obj].negative == 0):
-                            if (self.brain[q.subj]["IS"][obj].seen == 0):
-                                q2 = copy.copy(q)
-                                q2.subj_adj = self.brain[q.subj][q.verb][obj].obj_adj
-                                q2.subj = obj
-                                self.brain[q.subj][q.verb][obj].seen = 1
-                                [ ans,reason ] = self.query_i(q2)
-                                self.brain[q.subj][q.verb][obj].seen = 0
-                                if (ans == 0 or ans == 1):
-                                    reason = [self.brain[q.subj][q.verb][obj]] + reason
-                                    return [ ans,reason ]
+        return [ learned, conflicts ]
 
-            # If we reach this point, the query didn't find anything
-            return [ -1,[] ]
+    ##
+    ## Parse, store and check one batch of sentences for learn_many
+    ##
+    ## Inputs:
+    ##   lines: A list of (line number, string or fact) pairs
+    ##   conflicts: The list to append rejected sentences to
+    ##   check: If false, skip the consistency check
+    ##
+    ## Returns:
+    ##   The number of facts learned from this batch
+    ##
+    def learn_batch(self, lines, conflicts, check):
+        parsed = []
+        for (lineno, line) in lines:
+            if (type(line) == type("")):
+                line = line.strip()
+                if (line == ""):
+                    continue
+                try:
+                    newfact = fact(line)
+                except Exception:
+                    conflicts.append([ lineno, line, "I DON'T UNDERSTAND", [] ])
+                    continue
+            else:
+                newfact = line
+            parsed.append((lineno, line, newfact))
 
-        # If the question has a verb but not object, we do this
-        elif (q.obj == "" or q.obj == ".fact"):
-            if (self.brain[q.subj].has_key(q.verb)):
-                if (self.brain[q.subj][q.verb].has_key(".fact")):
-                    # See if we can find an exact match to the question
-                    ans = self.brain[q.subj][q.verb][".fact"].negative
-                    if (q.negative == 0):
-                        ans = 1 - ans
-                    return [ ans,[self.brain[q.subj][q.verb][".fact"]] ]
+        learned = 0
+        self.lock.acquire_write()
+        try:
+            for (lineno, line, newfact) in parsed:
+                if (newfact.error != ""):
+                    conflicts.append([ lineno, line, newfact.error, [] ])
+                    continue
 
-                # See if we can find a matching, non-negative match with
-                # a different object
-                for obj in self.brain[q.subj][q.verb]:
-                    if self.brain[q.subj][q.verb][obj].negative == 0:
-                        return [ 1,[self.brain[q.subj][q.verb][obj]] ]
+                if (newfact.subj == newfact.obj and newfact.negative == 1):
+                    conflicts.append([ lineno, line, "I'M NOT BUYING IT", [] ])
+                    continue
 
-                # No match, then the answer is unknown
-                return [ -1,[] ]
-            else:
-                # Replace the subject and search recursively
-                if self.brain[q.subj].has_key("IS"):
-                    for obj in self.brain[q.subj]["IS"]:
-                        if (self.brain[q.subj]["IS"][obj].seen == 0
-                            and self.brain[q.subj]["IS"][obj].negative == 0):
-                            q2 = copy.copy(q)
-                            q2.subj = obj
-                            q2.subj_adj = self.brain[q.subj]["IS"][obj].obj_adj
-                            self.brain[q.subj]["IS"][obj].seen = 1
-                            [ans,reason] = self.query_i(q2)
-                            self.brain[q.subj]["IS"][obj].seen = 0
+                if (check and self.may_know(newfact)):
+                    budget = search_budget(self.max_depth,
+                                           self.max_nodes or self.batch_nodes,
+                                           self.time_limit)
+                    try:
+                        [ stat, str, reason ] = \
+                            self.query_unlocked(newfact, None, 0, budget)
+                    except Exception, e:
+                        conflicts.append([ lineno, line,
+                                           "I CAN'T CHECK THAT (%s)" % e, [] ])
+                        continue
+                    if (str == budget_text):
+                        conflicts.append([ lineno, line, str, [] ])
+                        continue
+                    elif (stat == 0):
+                        conflicts.append([ lineno, line,
+                                           "THAT CAN'T BE RIGHT", reason ])
+                        continue
+                    elif (stat == 1):
+                        continue
 
-                            if (ans == 0 or ans == 1):
-                                reason = [self.brain[q.subj]["IS"][obj]] + reason
-                                return [ ans,reason ]
-                    
-                return [ -1,[] ]
+                result = self.store(newfact)
+                if (result is None):
+                    learned += 1
+                    if (self.journal is not None):
+                        self.journal.append("+", newfact)
+                elif (result[0] != "YEAH I KNOW"):
+                    conflicts.append([ lineno, line ] + result)
+        finally:
+            self.lock.release_write()
+
+        return learned
+
+    ##
+    ## Teach the brain every sentence in a file, using learn_many
+    ##
+    ## Inputs:
+    ##   filename: The name of the file to read, or an open file
+    ##   check: If false, skip the consistency check
+    ##
+    ## Returns:
+    ##   The same as learn_many
+    ##
+    def load_file(self, filename, check=1):
+        if (type(filename) == type("")):
+            f = open(filename, "rU")
+            try:
+                return self.learn_many(f, check)
+            finally:
+                f.close()
         else:
-            # The question has a subject, verb, and object
-            if (self.brain[q.subj].has_key(q.verb)):
-                if (self.brain[q.subj][q.verb].has_key(q.obj)):
-                    # Found an exact match
-                    ans = self.brain[q.subj][q.verb][q.obj].negative
-                    if (q.negative == 0):
-                        ans = 1 - ans
-                    return [ ans,[self.brain[q.subj][q.verb][q.obj]] ]
+            return self.learn_many(filename, check)
 
-            # Recursively replace the subject
-            if (self.brain[q.subj].has_key("IS")):
-                for obj in self.brain[q.subj]["IS"]:
-                    if (self.brain[q.subj]["IS"][obj].seen == 0
-                        and self.brain[q.subj]["IS"][obj].negative == 0):
-                        q2 = copy.copy(q)
-                        q2.subj_adj = self.brain[q.subj]["IS"][obj].obj_adj
-                        q2.subj = obj
-                        self.brain[q.subj]["IS"][obj].seen = 1
-                        [ans,reason] = self.query_i(q2)
-                        self.brain[q.subj]["IS"][obj].seen = 0
+    ##
+    ## Add an IS fact to the IS-A reachability index.  Every word that
+    ## reaches the fact's subject now also reaches its object and
+    ## everything the object reaches.
+    ##
+    ## Inputs:
+    ##   f: The IS fact that has just been stored in the brain
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def index_fact(self, f):
+        if (not self.is_into.has_key(f.obj)):
+            self.is_into[f.obj] = set()
+        self.is_into[f.obj].add(f.subj)
 
-                        if (ans == 0 or ans == 1):
-                            reason = [self.brain[q.subj]["IS"][obj]] + reason
-                            return [ ans,reason ]
+        if (f.negative or f.subj == f.obj):
+            return
 
-            # Try to find another word to use in place of the object
-            if (self.brain.has_key(q.obj)):
-                if (self.brain[q.obj].has_key("IS")):
-                    for obj in self.brain[q.obj]["IS"]:
-                        if (self.brain[q.obj]["IS"][obj].negative == 0):
-                            q2 = copy.copy(q)
-                            q2.obj_adj = self.brain[q.obj]["IS"][obj].obj_adj
-                            q2.obj = obj
-                            self.brain[q.obj]["IS"][obj].seen = 1
-                            [ans,reason] = self.query_i(q2)
-                            self.brain[q.obj]["IS"][obj].seen = 0
-                            if (ans == 1):
-                                reason = [self.brain[q.obj]["IS"][obj]] + reason
-                                return [ ans,reason ]
-                
-            return [ -1,[] ]
+        up = self.is_up.get(f.subj)
+        if (up is not None and f.obj in up):
+            # Nothing new is reachable
+            return
 
-##
-## This is where the user interface is defined.  It prompts the user for
-## input a line at a time.  The user can enter sentences (facts or
-## questions), or commands.
-##
-## Inputs:
-##   b: A brain object to store and retrieve information
-##
-## Returns:
-##   none
-##
-def ui():
-    reason = []
-    b = brain()
+        sources = set([f.subj])
+        sources.update(self.is_down.get(f.subj, ()))
+        targets = set([f.obj])
+        targets.update(self.is_up.get(f.obj, ()))
 
-    while (1):
-        sys.stdout.write("\n> ")
-        quote = sys.stdin.readline()
+        for word in sources:
+            if (not self.is_up.has_key(word)):
+                self.is_up[word] = set()
+            self.is_up[word].update(targets)
 
-        # Look for a command in the input string
-        quote = quote.strip()
-        cmd = quote.split()
+        for word in targets:
+            if (not self.is_down.has_key(word)):
+                self.is_down[word] = set()
+            self.is_down[word].update(sources)
+
+    ##
+    ## Take a fact that has just been removed from the brain out of the
+    ## IS-A index.  Only the words that are (directly or through other
+    ## words) the fact's subject can reach anything different, so only
+    ## theirs are worked out again.
+    ##
+    ## Inputs:
+    ##   f: The fact
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def unindex_fact(self, f):
+        into = self.is_into[f.obj]
+        into.discard(f.subj)
+        if (not into):
+            del self.is_into[f.obj]
+
+        if (f.negative or f.subj == f.obj):
+            return
+
+        sources = set([ f.subj ])
+        sources.update(self.is_down.get(f.subj, ()))
+
+        # A word outside sources can't reach f.subj, so nothing it
+        # reaches went by way of f and its is_up is still right
+        reached = {}
+        for word in sources:
+            up = set()
+            todo = [ word ]
+            followed = set(todo)
+            while (todo):
+                w = todo.pop()
+                for (obj, g) in self.brain.get(w, {}).get("IS", {}).iteritems():
+                    if (g.negative or obj == w or obj in up):
+                        continue
+                    up.add(obj)
+                    if (obj not in sources):
+                        up.update(self.is_up.get(obj, ()))
+                    elif (obj not in followed):
+                        followed.add(obj)
+                        todo.append(obj)
+            reached[word] = up
+
+        for word in sources:
+            old = self.is_up.get(word, set())
+            for lost in old - reached[word]:
+                down = self.is_down[lost]
+                down.discard(word)
+                if (not down):
+                    del self.is_down[lost]
+            if (reached[word]):
+                self.is_up[word] = reached[word]
+            elif (self.is_up.has_key(word)):
+                del self.is_up[word]
+
+    ##
+    ## Add a fact to the reverse index
+    ##
+    ## Inputs:
+    ##   f: The fact, already stored in the brain
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def reverse_fact(self, f):
+        verbs = self.reverse.get(f.obj)
+        if (verbs is None):
+            verbs = self.reverse[f.obj] = {}
+        subjects = verbs.get(f.verb)
+        if (subjects is None):
+            subjects = verbs[f.verb] = set()
+        subjects.add(f.subj)
+
+    ##
+    ## List the words that are (directly or through other words) a
+    ## concept, nearest first.  The list is worked out a step at a time
+    ## as it is read, holding the lock only while each step is taken, so
+    ## it may see facts learned while it is being read.
+    ##
+    ## Inputs:
+    ##   concept: The word to list the kinds of
+    ##
+    ## Returns:
+    ##   A generator of words
+    ##
+    def descendants(self, concept):
+        seen = set([ concept ])
+        words = [ concept ]
+        while (words):
+            found = []
+            self.lock.acquire_read()
+            try:
+                for word in words:
+                    for subj in self.kinds(word):
+                        if (subj not in seen):
+                            seen.add(subj)
+                            found.append(subj)
+            finally:
+                self.lock.release_read()
+
+            for word in found:
+                yield word
+            words = found
+
+    ##
+    ## Return the words with a positive IS fact about a word.  The caller
+    ## must hold the lock.
+    ##
+    ## Inputs:
+    ##   word: The word
+    ##
+    ## Returns:
+    ##   A list of words
+    ##
+    def kinds(self, word):
+        return [ subj for subj in self.reverse.get(word, {}).get("IS", ())
+                 if not self.brain[subj]["IS"][word].negative ]
+
+    ##
+    ## List the instances of a concept: the words that are one, but that
+    ## nothing else is.
+    ##
+    ## Inputs:
+    ##   concept: The word to list the instances of
+    ##   describe: If true, give each word with its attributes
+    ##
+    ## Returns:
+    ##   A generator of words, or of (word, attributes) tuples with the
+    ##   attributes as brain.attributes gives them
+    ##
+    def instances(self, concept, describe=0):
+        return self.filter_kinds(self.descendants(concept), 0, describe)
+
+    ##
+    ## List the subclasses of a concept: the words that are one, and that
+    ## something else is in turn.
+    ##
+    ## Inputs, Returns:
+    ##   As for instances
+    ##
+    def subclasses(self, concept, describe=0):
+        return self.filter_kinds(self.descendants(concept), 1, describe)
+
+    ##
+    ## The body of instances and subclasses
+    ##
+    ## Inputs:
+    ##   words: The words that are the concept
+    ##   subclasses: If true, keep the words something else is, otherwise
+    ##               the words nothing else is
+    ##   describe: If true, give each word with its attributes
+    ##
+    ## Returns:
+    ##   As for instances
+    ##
+    def filter_kinds(self, words, subclasses, describe):
+        for word in words:
+            self.lock.acquire_read()
+            try:
+                if ((len(self.kinds(word)) > 0) != (subclasses != 0)):
+                    continue
+                if (describe):
+                    word = (word, self.attributes(word)[0])
+            finally:
+                self.lock.release_read()
+            yield word
+
+    ##
+    ## List the words a question about some subject is answered yes to:
+    ## for example, with verb "LIKES" and obj "FISH", everything that
+    ## likes fish, whether it was said to or it is something that does.
+    ##
+    ## Inputs:
+    ##   verb: The verb of the question
+    ##   obj: The object of the question, or "" for none
+    ##   negative: If true, list the words the negative question is
+    ##             answered yes to instead
+    ##   describe: If true, give each word with its attributes
+    ##
+    ## Returns:
+    ##   A generator as for instances
+    ##
+    def subjects(self, verb, obj, negative=0, describe=0):
+        if (verb in to_be_words):
+            verb = "IS"
+        if (obj == ""):
+            obj = ".fact"
+
+        if (verb == "IS" and not negative):
+            # Everything found is one, by way of IS facts
+            words = self.descendants(obj)
+        else:
+            words = self.candidates(verb, obj)
+
+        q = fact("")
+        q.verb = verb
+        q.obj = obj
+        q.negative = negative
+        for word in words:
+            self.lock.acquire_read()
+            try:
+                if (verb != "IS" or negative):
+                    q.subj = word
+                    if (self.query_i(q)[0] != 1):
+                        continue
+                if (describe):
+                    word = (word, self.attributes(word)[0])
+            finally:
+                self.lock.release_read()
+            yield word
+
+    ##
+    ## List the words that might be answered yes to a question: the
+    ## subjects of the facts with the question's verb and either its
+    ## object or something its object is, and everything that is one of
+    ## those subjects
+    ##
+    ## Inputs:
+    ##   verb: The verb of the question
+    ##   obj: The object of the question
+    ##
+    ## Returns:
+    ##   A generator of words
+    ##
+    def candidates(self, verb, obj):
+        self.lock.acquire_read()
+        try:
+            # Facts about what the object is answer for it too
+            direct = []
+            for word in self.ancestors(obj):
+                direct.extend(self.reverse.get(word, {}).get(verb, ()))
+        finally:
+            self.lock.release_read()
+
+        seen = set()
+        for subj in direct:
+            if (subj in seen):
+                continue
+            seen.add(subj)
+            yield subj
+            for word in self.descendants(subj):
+                if (word not in seen):
+                    seen.add(word)
+                    yield word
+
+    ##
+    ## Use the IS-A index to decide whether an "IS" question about
+    ## subject can be answered at all, i.e. whether subject or anything
+    ## it is has an IS fact (positive or negative) about obj.
+    ##
+    ## Inputs:
+    ##   subject: The word the search starts from
+    ##   obj: The object of the question
+    ##
+    ## Returns:
+    ##   1 if a search from subject will find an answer, 0 if not
+    ##
+    def is_answerable(self, subject, obj):
+        into = self.is_into.get(obj)
+        if (not into):
+            return 0
+
+        if (subject in into):
+            return 1
+
+        up = self.is_up.get(subject)
+        if (not up):
+            return 0
+
+        if (up.isdisjoint(into)):
+            return 0
+        else:
+            return 1
+
+    ##
+    ## Use the IS-A index to decide whether a question with a verb other
+    ## than IS could be answered at all, without searching.  The search
+    ## only answers one from a fact with the same verb, about the
+    ## question's subject or a word it is, and with the question's
+    ## object or a word the object is (any object, if the question has
+    ## none).  The caller must hold the lock.
+    ##
+    ## Inputs:
+    ##   q: The question (must be a class fact)
+    ##
+    ## Returns:
+    ##   0 if a search will find no answer, otherwise 1.  Without the
+    ##   index, or for an IS question, it is always 1.
+    ##
+    def may_know(self, q):
+        if (not self.index or q.verb == "IS"):
+            return 1
+
+        if (q.obj == "" or q.obj == ".fact"):
+            objects = None
+        else:
+            objects = self.ancestors(q.obj)
+
+        for word in self.ancestors(q.subj):
+            if (not self.brain.has_key(word)
+                or not self.brain[word].has_key(q.verb)):
+                continue
+            if (objects is None
+                or not objects.isdisjoint(self.brain[word][q.verb])):
+                return 1
+        return 0
+
+    ##
+    ## Return a list of facts relating to a particular subject.  This
+    ## list will include items determined deductively.  When the search
+    ## limits are reached, the description stops going deeper, and holds
+    ## what was found within them.
+    ##
+    ## Inputs:
+    ##   subject: The subject we want to describe
+    ##
+    ## Returns:
+    ##   A list of facts about the given subject
+    ##
+    def describe_subj(self, subject):
+        budget = self.budget()
+        start = time.time()
+        self.lock.acquire_read()
+        try:
+            desc = self.describe_subj_i(subject, set(), None, budget, 1)
+        finally:
+            self.lock.release_read()
+        if (self.instrument):
+            self.record("describe", subject, budget, time.time() - start)
+        return desc
+
+    ##
+    ## Internal function for describing a subject.  The IS facts that
+    ## are currently being followed are kept in visited, which belongs
+    ## to this one description, so a cycle of IS facts can't make it
+    ## loop forever.
+    ##
+    ## Inputs:
+    ##   subject: The subject we want to describe
+    ##   visited: The set of (subject, verb, object) keys being followed
+    ##   deps: If not None, a set to add the words the description
+    ##         depends on to
+    ##   budget: If not None, the search_budget the search is limited by
+    ##   partial: If true, leave out what is past the budget rather than
+    ##            raising budget_exceeded
+    ##
+    ## Returns:
+    ##   A list of facts about the given subject
+    ##
+    def describe_subj_i(self, subject, visited, deps=None, budget=None,
+                        partial=0):
+        if (partial):
+            over = []
+        else:
+            over = None
+        return self.run(self.describe_subj_g(subject, visited, deps, budget),
+                        budget, over)
+
+    ##
+    ## The description behind describe_subj_i, written as a frame for
+    ## run
+    ##
+    ## Inputs:
+    ##   subject, visited, deps: As for describe_subj_i
+    ##   budget: If not None, the search_budget to count copied facts in
+    ##
+    ## Returns:
+    ##   A generator yielding (CALL, frame) and finally (RETURN, list)
+    ##
+    def describe_subj_g(self, subject, visited, deps, budget):
+        subject = upper(subject)
+        if (deps is not None):
+            deps.add(subject)
+        dfact = fact("")
+        symmetry = fact(subject+" is "+subject)
+        desc = [ symmetry ]
+
+        if (not self.brain.has_key(subject)):
+            yield (RETURN, desc)
+            return
+
+        for verb in self.brain[subject]:
+            for object in self.brain[subject][verb]:
+                dfact = copy.deepcopy(self.brain[subject][verb][object])
+                if (budget is not None):
+                    budget.copied += 1
+                key = (subject, verb, object)
+
+                if (key not in visited):
+                    desc.append(dfact)
+
+                    if (not dfact.verb in self.to_be):
+                        if (dfact.obj != ".fact" and not dfact.negative):
+                            dfact.obj = ""
+                            dfact.obj_adj = ""
+                            desc.append(dfact)
+                    elif (not dfact.negative):
+                        if (object == ".fact"):
+                            newsubj = dfact.verb
+                        else:
+                            newsubj = dfact.obj
+
+                        # Now, recursively look for more entries
+                        visited.add(key)
+                        desc2 = (yield (CALL, self.describe_subj_g(newsubj, visited, deps, budget)))
+                        visited.discard(key)
+
+                        # Convert the subject of each fact
+                        for index in xrange(0,len(desc2)):
+                            desc2[index].subj_adj = dfact.subj_adj
+                            desc2[index].subj = dfact.subj
+
+                        desc += desc2
+                        del desc2
+
+        yield (RETURN, desc)
+
+    ##
+    ## Run a search frame (see CALL and RETURN) to completion
+    ##
+    ## Inputs:
+    ##   frame: The generator to run
+    ##   budget: If not None, the search_budget to charge each frame to
+    ##   over: If not None, a call the budget has no room for isn't
+    ##         made, and this is its answer, instead of raising
+    ##         budget_exceeded
+    ##
+    ## Returns:
+    ##   The value the frame returns
+    ##
+    def run(self, frame, budget=None, over=None):
+        stack = [ frame ]
+        value = None
+        if (budget is not None):
+            budget.charge(1)
+        while (1):
+            [ kind, value ] = stack[-1].send(value)
+            if (kind == CALL):
+                if (budget is not None):
+                    try:
+                        budget.charge(len(stack) + 1)
+                    except budget_exceeded:
+                        if (over is None):
+                            raise
+                        value.close()
+                        value = over
+                        continue
+                stack.append(value)
+                value = None
+            else:
+                stack.pop()
+                if (not stack):
+                    return value
+
+    ##
+    ## Return a new search_budget with this brain's limits, or None if
+    ## it has none and isn't counting the work it does
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   A search_budget object or None
+    ##
+    def budget(self):
+        if (self.max_depth or self.max_nodes or self.time_limit
+            or self.instrument):
+            return search_budget(self.max_depth, self.max_nodes,
+                                 self.time_limit)
+        return None
+
+    ##
+    ## Add the work done by one operation to the totals, and pass it on
+    ## to the hooks
+    ##
+    ## Inputs:
+    ##   operation: "learn", "query" or "describe"
+    ##   f: The fact learned or asked, or the subject described
+    ##   budget: The search_budget the work was counted in
+    ##   seconds: How long the operation took
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def record(self, operation, f, budget, seconds):
+        self.stats_lock.acquire()
+        try:
+            totals = self.totals.get(operation)
+            if (totals is None):
+                totals = self.totals[operation] = {
+                    "count": 0, "nodes": 0, "deepest": 0, "copied": 0,
+                    "seconds": 0.0 }
+            totals["count"] += 1
+            totals["nodes"] += budget.visited
+            totals["deepest"] = max(totals["deepest"], budget.deepest)
+            totals["copied"] += budget.copied
+            totals["seconds"] += seconds
+        finally:
+            self.stats_lock.release()
+
+        for hook in self.hooks:
+            hook(operation, f, budget, seconds)
+
+    ##
+    ## Report the work done since the counts were last reset
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   A dictionary from each operation ("learn", "query", "describe")
+    ##   to a dictionary of the number done, the frames run, the most
+    ##   frames on the stack at once, the facts copied and the seconds
+    ##   taken
+    ##
+    def stats(self):
+        self.stats_lock.acquire()
+        try:
+            return dict([ (operation, dict(totals))
+                          for (operation, totals) in self.totals.items() ])
+        finally:
+            self.stats_lock.release()
+
+    ##
+    ## Set the counts reported by stats back to nothing
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def reset_stats(self):
+        self.stats_lock.acquire()
+        try:
+            self.totals = {}
+        finally:
+            self.stats_lock.release()
+
+    ##
+    ## Return the distinct attributes of a subject, as found by
+    ## describe_subj, along with the (verb, object) pairs of every
+    ## positive and negative fact the subject has or inherits through
+    ## positive IS facts.  Results are cached, and the cached entry for
+    ## a subject is dropped when anything it was built from changes.
+    ##
+    ## Inputs:
+    ##   subject: The subject we want the attributes of
+    ##   deps: If not None, a set to add the words the result depends on to
+    ##   budget: If not None, the search_budget the search is limited by
+    ##   known: If not None, a dictionary of the results already worked
+    ##          out, by subject, to look in first and add to, for callers
+    ##          that will ask about the same subjects again before the
+    ##          brain can change
+    ##
+    ## Returns:
+    ##   A list containing three items:
+    ##     A list of facts about the subject, without repeats
+    ##     A set of (verb, object) pairs of the positive facts
+    ##     A set of (verb, object) pairs of the negative facts
+    ##
+    def attributes(self, subject, deps=None, budget=None, known=None):
+        cached = None
+        if (known is not None):
+            cached = known.get(subject)
+        if (cached is None and self.attrs is not None):
+            cached = self.attrs.get(subject)
+        if (cached is not None):
+            if (known is not None):
+                known[subject] = cached
+            if (deps is not None):
+                deps.update(cached[3])
+            return cached[:3]
+
+        depends = set()
+        attrs = []
+        keys = set()
+        for f in self.describe_subj_i(subject, set(), depends, budget):
+            key = (f.verb, f.obj, f.negative)
+            if (key not in keys):
+                keys.add(key)
+                attrs.append(f)
+
+        positive = set()
+        negative = set()
+        for word in self.ancestors(subject):
+            depends.add(word)
+            for verb in self.brain.get(word, ()):
+                for (obj, f) in self.brain[word][verb].iteritems():
+                    if (f.negative):
+                        negative.add((verb, obj))
+                    else:
+                        positive.add((verb, obj))
+
+        if (self.attrs is not None):
+            self.attrs.put(subject, (attrs, positive, negative, depends),
+                           depends)
+        if (known is not None):
+            known[subject] = (attrs, positive, negative, depends)
+        if (deps is not None):
+            deps.update(depends)
+
+        return [ attrs, positive, negative ]
+
+    ##
+    ## Return a subject and every word it is, directly or through other
+    ## positive IS facts
+    ##
+    ## Inputs:
+    ##   subject: The word to start from
+    ##
+    ## Returns:
+    ##   A set of words, including subject
+    ##
+    def ancestors(self, subject):
+        if (self.index):
+            words = set(self.is_up.get(subject, ()))
+            words.add(subject)
+            return words
+
+        words = set([subject])
+        todo = [subject]
+        while (todo):
+            word = todo.pop()
+            if (self.brain.has_key(word) and self.brain[word].has_key("IS")):
+                for (obj, f) in self.brain[word]["IS"].iteritems():
+                    if (not f.negative and obj not in words):
+                        words.add(obj)
+                        todo.append(obj)
+        return words
+
+    ##
+    ## Ask a yes/no question to a brain.  The brain will recursively
+    ## search for an answer based on the facts it knows
+    ##
+    ## Inputs:
+    ##   question: The question to ask
+    ##   shortest: If true, look for the shortest reason for the answer;
+    ##             if None (the default), as brain.shortest says
+    ##
+    ## Returns:
+    ##   A number detailing the answerm, a string containing the answer, and
+    ##   a list of facts detailing the reason for the answer (assuming the
+    ##   answer isn't "I don't know")
+    ##
+    def query(self, question, shortest=None):
+        # Translate the question from a string to a fact if necessary
+        if (type(question) == type("")):
+            question = fact(question)
+
+        if (shortest is None):
+            shortest = self.shortest
+
+        if (not self.instrument):
+            self.lock.acquire_read()
+            try:
+                return self.answer_unlocked(question, shortest)
+            finally:
+                self.lock.release_read()
+
+        budget = self.budget()
+        start = time.time()
+        self.lock.acquire_read()
+        try:
+            answer = self.answer_unlocked(question, shortest, None, budget)
+        finally:
+            self.lock.release_read()
+        self.record("query", question, budget, time.time() - start)
+        return answer
+
+    ##
+    ## The body of query, for callers already holding the lock
+    ##
+    ## Inputs:
+    ##   question: The question to ask (must be a class fact)
+    ##   shortest: If true, look for the shortest reason for the answer
+    ##   answered: If not None, a dictionary of answers already worked
+    ##             out, to look in first and add to
+    ##   budget: If not None, the search_budget for the search
+    ##   known: As for attributes
+    ##
+    ## Returns:
+    ##   The same as query
+    ##
+    def answer_unlocked(self, question, shortest, answered=None, budget=None,
+                        known=None):
+        if (question.subj == question.obj and question.verb == "IS"):
+            return self.query_unlocked(question, None, shortest, budget)
+
+        if (shortest):
+            mode = ( 1, self.proof_limit )
+        else:
+            mode = ( 0, 0 )
+        key = (question.subj, question.verb, question.obj,
+               question.negative, mode)
+
+        answer = None
+        if (answered is not None):
+            answer = answered.get(key)
+        if (answer is None and self.answers is not None):
+            answer = self.answers.get(key)
+        if (answer is None):
+            if (self.answers is None and answered is None):
+                return self.query_unlocked(question, None, shortest, budget)
+
+            deps = set()
+            answer = self.query_unlocked(copy.copy(question), deps,
+                                         shortest, budget, known)
+            if (answer[1] != budget_text and self.answers is not None):
+                self.answers.put(key, answer, deps)
+        if (answered is not None):
+            answered[key] = answer
+
+        # The answer is worded after the question that was asked, which
+        # may have different adjectives from the one that was cached
+        [ ans, text, reason ] = answer
+        if (text.startswith("NO, ")):
+            question.negative = 1 - question.negative
+            text = "NO, "+question.swap_person().__str__()
+        elif (text.startswith("YES, ")):
+            text = "YES, "+question.swap_person().__str__()
+        return [ ans, text, list(reason) ]
+
+    ##
+    ## Ask a lot of questions at once.  The questions are taken a chunk at
+    ## a time; each chunk is answered in one go under the lock, so the
+    ## questions in it share the attributes and answers already worked
+    ## out for the chunk, whether or not the brain has an answer cache.
+    ##
+    ## With processes, the chunks are shared out among that many worker
+    ## processes, forked from this one, each with its own copy of the
+    ## brain.  Anything learned while they run is not seen by them.
+    ##
+    ## Inputs:
+    ##   questions: An iterable of questions (facts or strings)
+    ##   processes: The number of worker processes to use, or 0 to answer
+    ##              in this process
+    ##   chunk: The number of questions to answer in one go
+    ##   shortest: As for query
+    ##
+    ## Returns:
+    ##   A generator giving the same as query for each question, in order
+    ##
+    def query_many(self, questions, processes=0, chunk=1000, shortest=None):
+        if (shortest is None):
+            shortest = self.shortest
+
+        chunks = chunked(questions, chunk)
+        if (not processes):
+            for questions in chunks:
+                for answer in self.query_chunk(questions, shortest):
+                    yield answer
+            return
+
+        pool = fork_pool(self, processes)
+        try:
+            for answers in pool.imap(pool_query,
+                                     ((questions, shortest)
+                                      for questions in chunks)):
+                for answer in answers:
+                    yield answer
+        finally:
+            pool.terminate()
+
+    ##
+    ## Answer one chunk of query_many's questions
+    ##
+    ## Inputs:
+    ##   questions: A list of questions (facts or strings)
+    ##   shortest: If true, look for the shortest reason for the answer
+    ##
+    ## Returns:
+    ##   A list of answers, in the same order as questions
+    ##
+    def query_chunk(self, questions, shortest):
+        questions = list(questions)
+        for i in range(len(questions)):
+            if (type(questions[i]) == type("")):
+                questions[i] = fact(questions[i])
+
+        answers = []
+        answered = {}
+        known = {}
+        self.lock.acquire_read()
+        try:
+            for question in questions:
+                answers.append(self.answer_unlocked(question, shortest,
+                                                    answered, None, known))
+        finally:
+            self.lock.release_read()
+        return answers
+
+    ##
+    ## Work out the answer to a question, for callers already holding the
+    ## lock.  The answer is not reworded after the question.
+    ##
+    ## Inputs:
+    ##   question: The question to ask (must be a class fact)
+    ##   deps: If not None, a set to add the words the answer depends on to
+    ##   shortest: If true, look for the shortest reason for the answer
+    ##   budget: The search_budget for the search, or None for a new one
+    ##           with the brain's limits
+    ##   known: As for attributes
+    ##
+    ## Returns:
+    ##   The same as query
+    ##
+    def query_unlocked(self, question, deps=None, shortest=0, budget=None,
+                       known=None):
+        if (budget is None):
+            budget = self.budget()
+        try:
+            return self.query_budgeted(question, deps, budget, shortest,
+                                       known)
+        except budget_exceeded:
+            return [ -1, budget_text, [] ]
+
+    ##
+    ## The body of query_unlocked, searching within a budget
+    ##
+    ## Inputs:
+    ##   question: The question to ask (must be a class fact)
+    ##   deps: If not None, a set to add the words the answer depends on to
+    ##   budget: If not None, the search_budget the search is limited by
+    ##   shortest: If true, look for the shortest reason for the answer
+    ##   known: As for attributes
+    ##
+    ## Returns:
+    ##   The same as query
+    ##
+    def query_budgeted(self, question, deps, budget, shortest, known=None):
+        if (deps is not None):
+            deps.add(question.subj)
+            deps.add(question.obj)
+
+        # Simple checks
+        if (not self.brain.has_key(question.subj)
+            and not self.brain_obj.has_key(question.subj)):
+            
+            return [ -1, "WHAT'S THIS \""+question.subj+"\" THING?", [] ]
+
+        if (question.obj != ""
+            and not self.brain.has_key(question.obj)
+            and not self.brain_obj.has_key(question.obj)):
+            
+            return [ -1, "WHAT'S THIS \""+question.obj+"\" THING?", [] ]
+
+        if (question.verb != "IS"):
+            if (not self.brain_verb.has_key(question.verb)):
+                if (deps is not None):
+                    deps.add(("VERB", question.verb))
+                return [ -1, "I DON'T KNOW WHAT IT MEANS TO "+question.verb, [] ]
+
+        if (question.subj == question.obj and question.verb == "IS"):
+            if (question.negative == 0):
+                return [ 1, "DUH, YES", [question] ]
+            else:
+                return [ 0, "UGH, NO", [question] ]
+        
+        # Ask the question
+        [ans,reason] = self.query_i(question, None, deps, budget, shortest)
+
+        if (ans == 0):
+            question.negative = 1 - question.negative
+            return [ 0, "NO, "+question.swap_person().__str__(), reason ]
+        elif (ans == 1):
+            return [ 1, "YES, "+question.swap_person().__str__(), reason ]
+
+        # More checking is necessary here, just to be sure.  Look for
+        # an attribute of the subject that the object contradicts, or
+        # vice versa.  Only an attribute whose opposite is among the
+        # facts the other side has or inherits can be contradicted, so
+        # only those are asked about in full.
+        if (question.obj != "" and question.verb == "IS"):
+            [ subject_attr, subject_pos, subject_neg ] = \
+                self.attributes(question.subj, deps, budget, known)
+            [ object_attr, object_pos, object_neg ] = \
+                self.attributes(question.obj, deps, budget, known)
+
+            for (attrs, other, other_adj, other_pos, other_neg) in (
+                (subject_attr, question.obj, question.obj_adj,
+                 object_pos, object_neg),
+                (object_attr, question.subj, question.subj_adj,
+                 subject_pos, subject_neg)):
+
+                for f in attrs:
+                    obj = f.obj or ".fact"
+                    if (f.negative):
+                        if ((f.verb, obj) not in other_pos):
+                            continue
+                    elif ((f.verb, obj) not in other_neg):
+                        continue
+
+                    f2 = copy.copy(f)
+                    if (budget is not None):
+                        budget.copied += 1
+                    f2.subj = other
+                    f2.subj_adj = other_adj
+                    [ans,reason] = self.query_i(f2, None, deps, budget,
+                                                shortest)
+                    if (ans == 0):
+                        # Grab the reason for the fact f
+                        [ans,reason0] = self.query_i(f, None, deps, budget,
+                                                     shortest)
+                        reason = reason0 + reason
+
+                        if (question.negative == 0):
+                            question.negative = 1 - question.negative
+                            return [ 0, "NO, "+question.swap_person().__str__(), reason ]
+                        else :
+                            return [ 1, "YES, "+question.swap_person().__str__(), reason ]
+
+        return [ -1, "I DON'T KNOW", [] ]
+
+    ##
+    ## Internal function for asking a question.  This is where the real
+    ## processing takes place.
+    ##
+    ## Inputs:
+    ##   q: The question to ask (must be a class fact)
+    ##   visited: The set of IS facts that the search is currently
+    ##            following, as ("S", subject, object) keys when they
+    ##            stand in for the question's subject and ("O", subject,
+    ##            object) keys when they stand in for its object.  A fact
+    ##            in use for the object may not stand in for the subject
+    ##            as well, but one in use for the subject may still stand
+    ##            in for the object.  It belongs to a single question, so
+    ##            nothing stored in the brain is touched and any number
+    ##            of questions can run at once.
+    ##   deps: If not None, a set to add the words the answer depends on to
+    ##   budget: If not None, the search_budget the search is limited by
+    ##   shortest: If true, "IS" questions are answered by shortest_proof
+    ##
+    ## Returns:
+    ##   A list containing two values.  The first is:
+    ##     -1: I don't know
+    ##      0: No
+    ##      1: Yes
+    ##   and the second is a list of facts detailing the the reason for
+    ##   the decision.  If the answer is -1, the list will be empty.
+    ##
+    def query_i(self, q, visited=None, deps=None, budget=None, shortest=0):
+        if (shortest and q.verb == "IS" and q.obj != "" and q.obj != ".fact"):
+            return self.shortest_proof(q, deps, budget)
+        if (visited is None):
+            visited = set()
+        return self.run(self.query_g(q, visited, deps, budget), budget)
+
+    ##
+    ## Answer an "IS" question with the shortest reason there is: the
+    ## fewest positive IS facts leading from the subject to a word with
+    ## an IS fact about the object, followed by that fact.  With the index
+    ## the search works from both ends at once (backwards through
+    ## is_into), always widening the smaller side; without it, it works
+    ## forwards from the subject alone.  No reason longer than
+    ## brain.proof_limit facts is looked for, if that is set.
+    ##
+    ## Inputs:
+    ##   q: The question to ask (must be a class fact, with verb "IS")
+    ##   deps: If not None, a set to add the words the answer depends on to
+    ##   budget: If not None, the search_budget the search is limited by
+    ##
+    ## Returns:
+    ##   The same as query_i
+    ##
+    def shortest_proof(self, q, deps=None, budget=None):
+        if (deps is not None):
+            deps.add(q.subj)
+            deps.add(q.obj)
+
+        if (not self.brain.has_key(q.subj)):
+            return [ -1, [] ]
+        if (q.subj == q.obj):
+            # We can safely say an object is itself
+            return [ 1, [q] ]
+
+        # forward maps each word reached from the subject to the fact it
+        # was reached by, backward each word known to lead to the object
+        # to the next fact on the way there
+        forward = { q.subj: None }
+        backward = {}
+        if (self.index):
+            for word in self.is_into.get(q.obj, ()):
+                backward[word] = self.brain[word]["IS"][q.obj]
+        elif (self.brain.has_key(q.subj)
+              and self.brain[q.subj].get("IS", {}).has_key(q.obj)):
+            backward[q.subj] = self.brain[q.subj]["IS"][q.obj]
+
+        meet = None
+        if (backward.has_key(q.subj)):
+            meet = q.subj
+
+        ahead = [ q.subj ]
+        behind = backward.keys()
+        # The number of facts from each end to ahead and behind
+        length = [ 0, 1 ]
+        while (meet is None and ahead and (behind or not self.index)):
+            if (self.proof_limit and length[0] + length[1] >= self.proof_limit):
+                break
+
+            if (not self.index or len(ahead) <= len(behind)):
+                length[0] += 1
+                words = []
+                for word in ahead:
+                    if (budget is not None):
+                        budget.charge(length[0])
+                    if (deps is not None):
+                        deps.add(word)
+                    if (not self.brain.has_key(word)):
+                        continue
+                    for (obj, f) in self.brain[word].get("IS", {}).iteritems():
+                        if (f.negative or forward.has_key(obj)):
+                            continue
+                        forward[obj] = f
+                        words.append(obj)
+                        if (not self.index and self.brain.has_key(obj)
+                            and self.brain[obj].get("IS", {}).has_key(q.obj)):
+                            backward[obj] = self.brain[obj]["IS"][q.obj]
+                        if (backward.has_key(obj)):
+                            meet = obj
+                            break
+                    if (meet is not None):
+                        break
+                ahead = words
+            else:
+                length[1] += 1
+                words = []
+                for word in behind:
+                    if (budget is not None):
+                        budget.charge(length[1])
+                    for subj in self.is_into.get(word, ()):
+                        f = self.brain[subj]["IS"][word]
+                        if (f.negative or backward.has_key(subj)):
+                            continue
+                        backward[subj] = f
+                        words.append(subj)
+                        if (forward.has_key(subj)):
+                            meet = subj
+                            break
+                    if (meet is not None):
+                        break
+                behind = words
+
+        if (meet is None):
+            return [ -1, [] ]
+
+        # Put the reason together from the two halves
+        reason = []
+        word = meet
+        while (forward[word] is not None):
+            reason.append(forward[word])
+            word = forward[word].subj
+        reason.reverse()
+        word = meet
+        while (1):
+            f = backward[word]
+            reason.append(f)
+            if (f.obj == q.obj):
+                break
+            word = f.obj
+
+        ans = reason[-1].negative
+        if (q.negative == 0):
+            ans = 1 - ans
+        return [ ans, reason ]
+
+    ##
+    ## The search behind query_i, written as a frame for run: instead of
+    ## calling itself for each IS fact it follows, it yields the search
+    ## for the new subject or object and is sent back the answer.
+    ##
+    ## Inputs:
+    ##   q, visited, deps: As for query_i
+    ##   budget: If not None, the search_budget to count copied facts in
+    ##
+    ## Returns:
+    ##   A generator yielding (CALL, frame) and finally (RETURN, answer)
+    ##
+    def query_g(self, q, visited, deps, budget):
+        if (deps is not None):
+            deps.add(q.subj)
+            deps.add(q.obj)
+
+        # Look for the question's subject in the brain
+        if (not self.brain.has_key(q.subj)):
+            yield (RETURN, [ -1, [] ])
+            return
+        # If the question's verb is of the form "to be" we handle it like this
+        if (q.verb == "IS"):
+            if (q.subj == q.obj):
+                # We can safely say an object is itself
+                yield (RETURN, [ 1, [q] ])
+                return
+            if (self.brain[q.subj].has_key(q.verb)):
+                # Found a match in the brain.  We can answer definitively
+                # yes(1) or no(0)
+                if (self.brain[q.subj][q.verb].has_key(q.obj)):
+                    ans = self.brain[q.subj][q.verb][q.obj].negative
+
+                    if (q.negative == 0):
+                        ans = 1 - ans
+
+                    yield (RETURN, [ ans,[self.brain[q.subj][q.verb][q.obj]] ])
+
+                    return
+                else:
+                    # Didn't find a definitive answer.  If the index
+                    # says there is none to be found, don't go looking.
+                    if (self.index
+                        and not self.is_answerable(q.subj, q.obj)):
+                        yield (RETURN, [ -1,[] ])
+                        return
+                    # Look for it recursively, skipping any branch the
+                    # index knows is a dead end
+                    for obj in self.brain[q.subj][q.verb]:
+                        if (self.index
+                            and not self.is_answerable(obj, q.obj)):
+                            if (deps is not None):
+                                deps.add(obj)
+                            continue
+                        if (self.brain[q.subj][q.verb][obj].negative == 0):
+                            key = ("S", q.subj, obj)
+                            if (key not in visited
+                                and ("O", q.subj, obj) not in visited):
+                                q2 = copy.copy(q)
+                                if (budget is not None):
+                                    budget.copied += 1
+                                q2.subj_adj = self.brain[q.subj][q.verb][obj].obj_adj
+                                q2.subj = obj
+                                visited.add(key)
+                                [ ans,reason ] = (yield (CALL, self.query_g(q2, visited, deps, budget)))
+                                visited.discard(key)
+                                if (ans == 0 or ans == 1):
+                                    reason = [self.brain[q.subj][q.verb][obj]] + reason
+                                    yield (RETURN, [ ans,reason ])
+                                    return
+            # If we reach this point, the query didn't find anything
+            yield (RETURN, [ -1,[] ])
+            return
+        # If the question has a verb but not object, we do this
+        elif (q.obj == "" or q.obj == ".fact"):
+            if (self.brain[q.subj].has_key(q.verb)):
+                if (self.brain[q.subj][q.verb].has_key(".fact")):
+                    # See if we can find an exact match to the question
+                    ans = self.brain[q.subj][q.verb][".fact"].negative
+                    if (q.negative == 0):
+                        ans = 1 - ans
+                    yield (RETURN, [ ans,[self.brain[q.subj][q.verb][".fact"]] ])
+                    return
+                # See if we can find a matching, non-negative match with
+                # a different object
+                for obj in self.brain[q.subj][q.verb]:
+                    if self.brain[q.subj][q.verb][obj].negative == 0:
+                        yield (RETURN, [ 1,[self.brain[q.subj][q.verb][obj]] ])
+                        return
+                # No match, then the answer is unknown
+                yield (RETURN, [ -1,[] ])
+                return
+            else:
+                # Replace the subject and search recursively
+                if self.brain[q.subj].has_key("IS"):
+                    for obj in self.brain[q.subj]["IS"]:
+                        key = ("S", q.subj, obj)
+                        if (key not in visited
+                            and ("O", q.subj, obj) not in visited
+                            and self.brain[q.subj]["IS"][obj].negative == 0):
+                            q2 = copy.copy(q)
+                            if (budget is not None):
+                                budget.copied += 1
+                            q2.subj = obj
+                            q2.subj_adj = self.brain[q.subj]["IS"][obj].obj_adj
+                            visited.add(key)
+                            [ans,reason] = (yield (CALL, self.query_g(q2, visited, deps, budget)))
+                            visited.discard(key)
+
+                            if (ans == 0 or ans == 1):
+                                reason = [self.brain[q.subj]["IS"][obj]] + reason
+                                yield (RETURN, [ ans,reason ])
+                                return
+                yield (RETURN, [ -1,[] ])
+                return
+        else:
+            # The question has a subject, verb, and object
+            if (self.brain[q.subj].has_key(q.verb)):
+                if (self.brain[q.subj][q.verb].has_key(q.obj)):
+                    # Found an exact match
+                    ans = self.brain[q.subj][q.verb][q.obj].negative
+                    if (q.negative == 0):
+                        ans = 1 - ans
+                    yield (RETURN, [ ans,[self.brain[q.subj][q.verb][q.obj]] ])
+                    return
+            # Recursively replace the subject
+            if (self.brain[q.subj].has_key("IS")):
+                for obj in self.brain[q.subj]["IS"]:
+                    key = ("S", q.subj, obj)
+                    if (key not in visited
+                        and ("O", q.subj, obj) not in visited
+                        and self.brain[q.subj]["IS"][obj].negative == 0):
+                        q2 = copy.copy(q)
+                        if (budget is not None):
+                            budget.copied += 1
+                        q2.subj_adj = self.brain[q.subj]["IS"][obj].obj_adj
+                        q2.subj = obj
+                        visited.add(key)
+                        [ans,reason] = (yield (CALL, self.query_g(q2, visited, deps, budget)))
+                        visited.discard(key)
+
+                        if (ans == 0 or ans == 1):
+                            reason = [self.brain[q.subj]["IS"][obj]] + reason
+                            yield (RETURN, [ ans,reason ])
+                            return
+            # Try to find another word to use in place of the object
+            if (self.brain.has_key(q.obj)):
+                if (self.brain[q.obj].has_key("IS")):
+                    for obj in self.brain[q.obj]["IS"]:
+                        key = ("O", q.obj, obj)
+                        if (key not in visited
+                            and self.brain[q.obj]["IS"][obj].negative == 0):
+                            q2 = copy.copy(q)
+                            if (budget is not None):
+                                budget.copied += 1
+                            q2.obj_adj = self.brain[q.obj]["IS"][obj].obj_adj
+                            q2.obj = obj
+                            visited.add(key)
+                            [ans,reason] = (yield (CALL, self.query_g(q2, visited, deps, budget)))
+                            visited.discard(key)
+                            if (ans == 1):
+                                reason = [self.brain[q.obj]["IS"][obj]] + reason
+                                yield (RETURN, [ ans,reason ])
+                                return
+            yield (RETURN, [ -1,[] ])
+            return
+
+##
+## Split an iterable into lists
+##
+## Inputs:
+##   items: The iterable to split
+##   size: The most items in each list
+##
+## Returns:
+##   A generator of lists
+##
+def chunked(items, size):
+    items = iter(items)
+    while (1):
+        part = list(islice(items, size))
+        if (not part):
+            return
+        yield part
+
+# The brain a query_many worker process answers questions from
+pool_brain = None
+
+##
+## Set up a query_many worker process.  The brain comes across with the
+## fork rather than being pickled.  Another thread may have been holding
+## one of its locks, or been part way through changing a cache, when the
+## fork was made, so the worker gets new locks and empty caches.
+##
+## Inputs:
+##   b: The brain to answer from
+##
+## Returns:
+##   none
+##
+def pool_init(b):
+    global pool_brain, parse_cache
+    pool_brain = b
+    b.lock = rwlock()
+    b.stats_lock = threading.Lock()
+    b.reset_stats()
+    if (b.answers is not None):
+        b.answers = memo(b.answers.size)
+        b.attrs = memo(b.attrs.size)
+    if (parse_cache is not None):
+        parse_cache = memo(parse_cache.size)
+
+    # A collection would write to every object the worker shares with
+    # its parent, and so copy all their pages
+    gc.disable()
+
+##
+## Fork worker processes that answer questions from a brain as it is now
+##
+## Inputs:
+##   b: The brain to answer from
+##   processes: The number of worker processes
+##
+## Returns:
+##   a multiprocessing.Pool whose workers run pool_query
+##
+def fork_pool(b, processes):
+    # Nothing may be half learned when the workers are forked
+    b.lock.acquire_read()
+    try:
+        gc.collect()
+        return multiprocessing.Pool(processes, pool_init, (b,))
+    finally:
+        b.lock.release_read()
+
+##
+## Answer a chunk of questions in a query_many worker process
+##
+## Inputs:
+##   work: A (questions, shortest) tuple, as for brain.query_chunk
+##
+## Returns:
+##   The same as brain.query_chunk
+##
+def pool_query(work):
+    [ questions, shortest ] = work
+    return pool_brain.query_chunk(questions, shortest)
+
+##
+## A brain with read-only copies of itself in forked worker processes.
+## The copies share the brain's memory with it until either side writes
+## to a page, so they cost little to make.  Questions are shared out
+## among the workers a chunk at a time and the answers come back in
+## order; facts are learned and forgotten by the brain itself.  The
+## workers are forked again, to pick up what has changed, by publish(),
+## or by query_many once every changes have been made since the last
+## time.
+##
+class replicas:
+    ##
+    ## Initialize the workers
+    ##
+    ## Inputs:
+    ##   b: The brain to answer from
+    ##   processes: The number of worker processes, or 0 for one per CPU
+    ##   chunk: The number of questions to send to a worker in one go
+    ##   every: How many changes the workers may be behind the brain,
+    ##          or 0 to wait for publish()
+    ##
+    ## Returns:
+    ##   a replicas object
+    ##
+    def __init__(self, b, processes=0, chunk=1000, every=1000):
+        if (not processes):
+            processes = multiprocessing.cpu_count()
+        self.brain = b
+        self.processes = processes
+        self.chunk = chunk
+        self.every = every
+        self.pool = None
+        self.publish()
+
+    ##
+    ## Learn a fact.  The workers see it once it is published.
+    ##
+    ## Inputs:
+    ##   newfact: As for brain.learn
+    ##
+    ## Returns:
+    ##   The same as brain.learn
+    ##
+    def learn(self, newfact):
+        result = self.brain.learn(newfact)
+        if (learn_codes.get(result[0]) == 1):
+            self.changes += 1
+        return result
+
+    ##
+    ## Forget a fact.  The workers forget it once this is published.
+    ##
+    ## Inputs:
+    ##   oldfact: As for brain.forget
+    ##
+    ## Returns:
+    ##   The same as brain.forget
+    ##
+    def forget(self, oldfact):
+        result = self.brain.forget(oldfact)
+        if (result[0] == "FORGOTTEN"):
+            self.changes += 1
+        return result
+
+    ##
+    ## Start new workers forked from the brain as it is now.  Questions
+    ## already handed to the old ones are answered by them.
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def publish(self):
+        old = self.pool
+        self.pool = fork_pool(self.brain, self.processes)
+        self.changes = 0
+
+        # The old workers finish what they were given, then go
+        if (old is not None):
+            old.close()
+
+    ##
+    ## Ask a lot of questions at once, as brain.query_many does
+    ##
+    ## Inputs:
+    ##   questions: An iterable of questions (facts or strings)
+    ##   shortest: As for query
+    ##
+    ## Returns:
+    ##   A generator giving the same as query for each question, in order
+    ##
+    def query_many(self, questions, shortest=None):
+        if (shortest is None):
+            shortest = self.brain.shortest
+        if (self.pool is None or
+            (self.every and self.changes >= self.every)):
+            self.publish()
+
+        # The generator keeps the pool it started with
+        pool = self.pool
+        for answers in pool.imap(pool_query,
+                                 ((questions, shortest)
+                                  for questions in chunked(questions,
+                                                           self.chunk))):
+            for answer in answers:
+                yield answer
+
+    ##
+    ## Ask one question
+    ##
+    ## Inputs:
+    ##   question: As for brain.query
+    ##   shortest: As for brain.query
+    ##
+    ## Returns:
+    ##   The same as brain.query
+    ##
+    def query(self, question, shortest=None):
+        for answer in self.query_many([ question ], shortest):
+            return answer
+
+    ##
+    ## Stop the workers
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def close(self):
+        if (self.pool is not None):
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+######################################################################
+##
+## Snapshots are a compact binary image of a brain, for saving and
+## restoring a brain quickly.  SAVE and LOAD are still the way to move
+## knowledge around in plain English.
+##
+## A snapshot file is laid out like this, all integers being unsigned
+## 32 bit little endian:
+##
+##   magic "DEDUCEBS", version, number of strings, number of facts,
+##   number of verbs, number of objects
+##   string table: number of strings + 1 offsets into the string data,
+##                 followed by the string data itself
+##   facts: subj_adj, subj, helping_verb, verb, orig_verb, obj_adj, obj
+##          (string numbers), question, negative -- per fact
+##   verbs: (string number, count) pairs -- brain.brain_verb
+##   objects: (string number, count) pairs -- brain.brain_obj
+##
+## Version 1 snapshots were written when brain_verb and brain_obj held
+## only 1s; their counts are worked out again from the facts.
+##
+######################################################################
+snapshot_magic = "DEDUCEBS"
+snapshot_version = 2
+snapshot_header = struct.Struct("<8sIIIII")
+snapshot_fields = ("subj_adj", "subj", "helping_verb", "verb", "orig_verb",
+                   "obj_adj", "obj")
+
+if (array("I").itemsize == 4):
+    snapshot_type = "I"
+else:
+    snapshot_type = "L"
+
+##
+## Write a snapshot of a brain to a file.  The snapshot is written to a
+## temporary file that is then renamed over filename, so an existing
+## snapshot is never left half written.
+##
+## Inputs:
+##   b: The brain to save
+##   filename: The name of the file to write
+##
+## Returns:
+##   The number of facts written
+##
+def save_snapshot(b, filename):
+    b.lock.acquire_read()
+    try:
+        return write_snapshot(b, filename)
+    finally:
+        b.lock.release_read()
+
+##
+## The body of save_snapshot, for callers already holding the brain's
+## lock
+##
+## Inputs:
+##   b: The brain to save
+##   filename: The name of the file to write
+##
+## Returns:
+##   The number of facts written
+##
+def write_snapshot(b, filename):
+    strings = {}
+    table = []
+    facts = array(snapshot_type)
+
+    def intern_string(word):
+        number = strings.get(word)
+        if (number is None):
+            number = strings[word] = len(table)
+            table.append(word)
+        return number
+
+    count = 0
+    for s in b.brain:
+        for v in b.brain[s]:
+            for o in b.brain[s][v]:
+                f = b.brain[s][v][o]
+                for name in snapshot_fields:
+                    facts.append(intern_string(getattr(f, name)))
+                facts.append(f.question)
+                facts.append(f.negative)
+                count += 1
+
+    verbs = array(snapshot_type)
+    for (word, value) in b.brain_verb.iteritems():
+        verbs.append(intern_string(word))
+        verbs.append(value)
+
+    objects = array(snapshot_type)
+    for (word, value) in b.brain_obj.iteritems():
+        objects.append(intern_string(word))
+        objects.append(value)
+
+    offsets = array(snapshot_type, [0])
+    for word in table:
+        offsets.append(offsets[-1] + len(word))
+
+    if (sys.byteorder != "little"):
+        for a in (offsets, facts, verbs, objects):
+            a.byteswap()
+
+    tmpname = filename + ".tmp"
+    f = open(tmpname, "wb")
+    try:
+        f.write(snapshot_header.pack(snapshot_magic, snapshot_version,
+                                     len(table), count,
+                                     len(verbs) / 2, len(objects) / 2))
+        f.write(offsets.tostring())
+        f.write("".join(table))
+        f.write(facts.tostring())
+        f.write(verbs.tostring())
+        f.write(objects.tostring())
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmpname, filename)
+
+    return count
+
+##
+## Read a snapshot written by save_snapshot back into a new brain.  The
+## file is mapped into memory rather than read.
+##
+## Inputs:
+##   filename: The name of the file to read
+##   index: Passed on to the new brain
+##
+## Returns:
+##   A new brain object
+##
+def load_snapshot(filename, index=1):
+    f = open(filename, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if (size < snapshot_header.size):
+            raise IOError("%s is not a Deduce snapshot" % filename)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    try:
+        [magic, version, nstrings, nfacts, nverbs, nobjects] = \
+            snapshot_header.unpack_from(data, 0)
+        if (magic != snapshot_magic):
+            raise IOError("%s is not a Deduce snapshot" % filename)
+        if (version != snapshot_version and version != 1):
+            raise IOError("%s is a version %d snapshot, expected %d"
+                          % (filename, version, snapshot_version))
+
+        def read_array(start, count):
+            a = array(snapshot_type)
+            a.fromstring(data[start:start + count * 4])
+            if (len(a) != count):
+                raise IOError("%s is truncated" % filename)
+            if (sys.byteorder != "little"):
+                a.byteswap()
+            return a
+
+        pos = snapshot_header.size
+        offsets = read_array(pos, nstrings + 1)
+        pos += (nstrings + 1) * 4
+        blob = data[pos:pos + offsets[-1]]
+        pos += offsets[-1]
+        table = [ intern(blob[offsets[i]:offsets[i + 1]])
+                  for i in xrange(nstrings) ]
+
+        nfields = len(snapshot_fields)
+        width = nfields + 2
+        facts = read_array(pos, nfacts * width)
+        pos += nfacts * width * 4
+        verbs = read_array(pos, nverbs * 2)
+        pos += nverbs * 2 * 4
+        objects = read_array(pos, nobjects * 2)
+    finally:
+        data.close()
+
+    b = brain(index)
+    facts = facts.tolist()
+
+    # Nothing built here can be part of a reference cycle, so don't let
+    # the garbage collector keep scanning the growing brain
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for i in xrange(0, nfacts * width, width):
+            f = fact.__new__(fact)
+            [ f.subj_adj, f.subj, f.helping_verb, f.verb, f.orig_verb,
+              f.obj_adj, f.obj ] = [ table[n] for n in facts[i:i + nfields] ]
+            f.question = facts[i + nfields]
+            f.negative = facts[i + nfields + 1]
+            f.error = ""
+
+            verbs_of = b.brain.get(f.subj)
+            if (verbs_of is None):
+                verbs_of = b.brain[f.subj] = {}
+            objects_of = verbs_of.get(f.verb)
+            if (objects_of is None):
+                objects_of = verbs_of[f.verb] = {}
+            objects_of[f.obj] = f
+
+            b.reverse_fact(f)
+            if (index and f.verb == "IS"):
+                b.index_fact(f)
+    finally:
+        if (collecting):
+            gc.enable()
+
+    if (version == 1):
+        # These only held 1s when the snapshot was written
+        for verbs_of in b.brain.itervalues():
+            for (verb, objects_of) in verbs_of.iteritems():
+                b.brain_verb[verb] = b.brain_verb.get(verb, 0) + len(objects_of)
+                for obj in objects_of:
+                    b.brain_obj[obj] = b.brain_obj.get(obj, 0) + 1
+    else:
+        for i in xrange(0, nverbs * 2, 2):
+            b.brain_verb[table[verbs[i]]] = verbs[i + 1]
+        for i in xrange(0, nobjects * 2, 2):
+            b.brain_obj[table[objects[i]]] = objects[i + 1]
+
+    return b
+
+######################################################################
+##
+## A journal is an append-only log of everything a brain learns, so a
+## brain that is fed continuously can be rebuilt after a crash from its
+## latest snapshot plus the journal, rather than from scratch.
+##
+## Each record is one line: a CRC32 of the rest of the line in hex, an
+## operation ("+" for a learned fact, "-" for a forgotten one, "*" for
+## forgetting everything before it), the fact's word fields and its
+## question and negative flags, all separated by tabs.  Words never
+## contain whitespace, so no quoting is needed.  A line that is cut
+## short or fails its CRC marks the end of the usable journal.
+##
+######################################################################
+class journal:
+    ##
+    ## Open a journal for appending, creating it if necessary
+    ##
+    ## Inputs:
+    ##   filename: The journal file
+    ##   sync_every: fsync after this many records...
+    ##   sync_interval: ...or when this many seconds have passed since
+    ##                  the last fsync, whichever comes first
+    ##
+    ## Returns:
+    ##   a journal object
+    ##
+    def __init__(self, filename, sync_every=1000, sync_interval=1.0):
+        self.filename = filename
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time.time()
+
+        # Drop any torn record left at the end by a crash, so that new
+        # records don't end up hidden behind it
+        length = 0
+        if (os.path.exists(filename)):
+            for (op, f, length) in replay_journal(filename):
+                pass
+
+        self.file = open(filename, "ab")
+        self.file.truncate(length)
+
+    ##
+    ## Append a record to the journal.  The record is buffered, and only
+    ## forced to disk once enough records or time have built up.
+    ##
+    ## Inputs:
+    ##   op: The operation ("+", "-" or "*")
+    ##   f: The fact
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def append(self, op, f):
+        line = "\t".join([ op ]
+                         + [ getattr(f, name) for name in snapshot_fields ]
+                         + [ "%d" % f.question, "%d" % f.negative ])
+        self.file.write("%08x\t%s\n" % (crc32(line) & 0xffffffff, line))
+
+        self.pending += 1
+        if (self.pending >= self.sync_every
+            or time.time() - self.last_sync >= self.sync_interval):
+            self.sync()
+
+    ##
+    ## Force every record appended so far to disk
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.time()
+
+    ##
+    ## Throw away every record, once they are all in a snapshot
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def truncate(self):
+        self.file.truncate(0)
+        self.sync()
+
+    ##
+    ## Sync and close the journal
+    ##
+    ## Inputs:
+    ##   none
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def close(self):
+        if (not self.file.closed):
+            self.sync()
+            self.file.close()
+
+##
+## Read the records back out of a journal file
+##
+## Inputs:
+##   filename: The journal file
+##
+## Returns:
+##   A generator of (operation, fact, length) tuples, where length is the
+##   size of the journal up to and including that record
+##
+def replay_journal(filename):
+    f = open(filename, "rb")
+    try:
+        length = 0
+        nfields = len(snapshot_fields)
+        for line in f:
+            if (not line.endswith("\n")):
+                return
+            fields = line[:-1].split("\t")
+            if (len(fields) != nfields + 4):
+                return
+            try:
+                if (int(fields[0], 16) != crc32(line[9:-1]) & 0xffffffff):
+                    return
+            except ValueError:
+                return
+
+            newfact = fact.__new__(fact)
+            for (name, value) in zip(snapshot_fields, fields[2:]):
+                setattr(newfact, name, intern(value))
+            newfact.question = int(fields[-2])
+            newfact.negative = int(fields[-1])
+            newfact.error = ""
+
+            length += len(line)
+            yield (fields[1], newfact, length)
+    finally:
+        f.close()
+
+##
+## Rebuild a brain after a restart: restore the latest snapshot, if
+## there is one, apply everything in the journal after it, and attach
+## the journal to the brain so it keeps recording.
+##
+## Inputs:
+##   snapshot: The snapshot file
+##   journal_file: The journal file
+##   index: Passed on to the new brain
+##
+## Returns:
+##   A brain object
+##
+def recover(snapshot, journal_file, index=1):
+    if (os.path.exists(snapshot)):
+        b = load_snapshot(snapshot, index)
+    else:
+        b = brain(index)
+
+    if (os.path.exists(journal_file)):
+        for (op, f, length) in replay_journal(journal_file):
+            if (op == "+"):
+                # The fact was checked when it was learned, and may
+                # well already be in the snapshot
+                b.store(f)
+            elif (op == "-"):
+                b.unstore(f)
+            elif (op == "*"):
+                b.clear()
+
+    b.journal = journal(journal_file)
+    return b
+
+##
+## Save a snapshot of a brain and empty its journal, so the next
+## recovery doesn't have to replay everything from the start.  New facts
+## are held off until both are done.
+##
+## Inputs:
+##   b: The brain, with a journal attached
+##   snapshot: The snapshot file
+##
+## Returns:
+##   The number of facts written
+##
+def checkpoint(b, snapshot):
+    b.lock.acquire_write()
+    try:
+        count = write_snapshot(b, snapshot)
+        if (b.journal is not None):
+            b.journal.truncate()
+    finally:
+        b.lock.release_write()
+
+    return count
+
+###########################################################################
+##
+## A session is one user's conversation with a brain: it carries out the
+## commands, statements and questions typed at it and remembers the
+## reason for the last answer, for WHY.  Any number of sessions can share
+## a brain.
+##
+###########################################################################
+class session:
+    ##
+    ## Initialize a new session
+    ##
+    ## Inputs:
+    ##   b: The brain to talk to
+    ##   out: A file to write the replies to
+    ##
+    ## Returns:
+    ##   a session object
+    ##
+    def __init__(self, b, out):
+        self.brain = b
+        self.out = out
+        self.reason = []
+
+    # The words that start a command rather than a statement or question
+    commands = frozenset([ "HELP", "SAVE", "LOAD", "SNAPSHOT", "RESTORE",
+                           "DIVULGE", "FORGET", "WHY", "WHAT", "WHO",
+                           "STATS", "SHORTEST", "ABOUT",
+                           "QUIT", "EXIT", "BYE", "STOP" ])
+
+    ##
+    ## Tell whether a line is a command, as command() would see it
+    ##
+    ## Inputs:
+    ##   quote: The line typed
+    ##
+    ## Returns:
+    ##   1 if the line is a command, 0 if it is a statement or question
+    ##
+    def is_command(self, quote):
+        cmd = quote.split()
+        return (len(cmd) <= 1 or upper(cmd[0]) in self.commands)
+
+    ##
+    ## Write a line of reply, the way print would
+    ##
+    ## Inputs:
+    ##   args: The things to write, separated by spaces
+    ##
+    ## Returns:
+    ##   none
+    ##
+    def say(self, *args):
+        self.out.write(join([ arg.__str__() for arg in args ], " ") + "\n")
+
+    ##
+    ## Carry out one line of input
+    ##
+    ## Inputs:
+    ##   quote: The line typed
+    ##
+    ## Returns:
+    ##   0 if the session is over, otherwise 1
+    ##
+    def command(self, quote):
+        b = self.brain
+
+        # Look for a command in the input string
+        quote = quote.strip()
+        cmd = quote.split()
         if (len(cmd) > 0):
             cmd[0] = cmd[0].upper()
     
         # Execute the command
         if (quote == ""):
-            print "I BEG YOUR PARDON?"
+            self.say("I BEG YOUR PARDON?")
 
         elif (cmd[0] == "HELP"):
-            print "LOAD <filename> - Load a session from a file"
-            print "SAVE <filename> - Save your current session to a file"
-            print "FORGET - Clear Deduce's memory"
-            print "WHY - Have Deduce explain its answer to a question"
-            print "DIVULGE - Dump Deduce's memory to the screen"
-            print "HELP - Display this help text"
-            print "ABOUT - Display information about Deduce"
-            print "QUIT - Exit the program"
+            self.say("LOAD <filename> - Load a session from a file")
+            self.say("SAVE <filename> - Save your current session to a file")
+            self.say("SNAPSHOT <filename> - Save a binary snapshot of Deduce's memory")
+            self.say("RESTORE <filename> - Restore a snapshot made with SNAPSHOT")
+            self.say("FORGET - Clear Deduce's memory")
+            self.say("FORGET <statement> - Have Deduce forget a single fact")
+            self.say("WHY - Have Deduce explain its answer to a question")
+            self.say("WHAT IS A <thing>? - List everything Deduce knows is one")
+            self.say("WHO <verb> <thing>? - List everything Deduce knows does")
+            self.say("SHORTEST ON|OFF|<n> - Explain answers as briefly as possible")
+            self.say("                      (in no more than <n> facts)")
+            self.say("DIVULGE - Dump Deduce's memory to the screen")
+            self.say("STATS [ON|OFF|RESET] - Show or control Deduce's work counts")
+            self.say("HELP - Display this help text")
+            self.say("ABOUT - Display information about Deduce")
+            self.say("QUIT - Exit the program")
 
         elif (cmd[0] == "SAVE"):
             if (len(cmd) != 2):
-                print "** Usage: SAVE <filename>"
+                self.say("** Usage: SAVE <filename>")
             else:
                 try:
                     f = file(cmd[1], "w")
-                    f.write(b.__str__())
-                    f.close()
-                    print "SESSION SAVED"
+                    try:
+                        b.write_facts(f)
+                    finally:
+                        f.close()
+                    self.say("SESSION SAVED")
                 except IOError, err:
-                    print "** Error saving:", err
+                    self.say("** Error saving:", err)
 
         elif (cmd[0] == "LOAD"):
             if (len(cmd) != 2):
-                print "** Usage: LOAD <filename>"
+                self.say("** Usage: LOAD <filename>")
             else:
                 try:
-                    f = file(cmd[1], "rU")
-                    count = 0
-
-                    for line in iter(f):
-                        count += 1
-                        line = line.strip()
+                    [count, conflicts] = b.load_file(cmd[1])
 
-                        if (len(line) > 0):
-                            [msg, reason] = b.learn(line)
-                            print count.__str__()+":",line," ("+msg+")"
+                    for [lineno, line, msg, why] in conflicts:
+                        self.say(lineno.__str__()+":",line," ("+msg+")")
 
-                        if (count >= 10000):
-                            print "Too many input lines, bailing out"
-                            break
-                        
-                    f.close()
-                    print "SESSION LOADED"
+                    self.say(count, "FACTS LEARNED")
+                    self.say("SESSION LOADED")
                 except IOError, err:
-                    print "** Error loading:", err
+                    self.say("** Error loading:", err)
+
+        elif (cmd[0] == "SNAPSHOT"):
+            if (len(cmd) != 2):
+                self.say("** Usage: SNAPSHOT <filename>")
+            else:
+                try:
+                    count = save_snapshot(b, cmd[1])
+                    self.say(count, "FACTS SAVED")
+                except (IOError, OSError), err:
+                    self.say("** Error saving:", err)
+
+        elif (cmd[0] == "RESTORE"):
+            if (len(cmd) != 2):
+                self.say("** Usage: RESTORE <filename>")
+            else:
+                try:
+                    b.replace(load_snapshot(cmd[1], b.index))
+                    self.reason = []
+                    self.say("SESSION RESTORED")
+                except (IOError, OSError), err:
+                    self.say("** Error loading:", err)
 
         elif (cmd[0] == "DIVULGE"):
-            print b
+            b.write_facts(self.out)
+            self.say()
+
+        elif (cmd[0] == "FORGET" and len(cmd) > 1):
+            # Forget just the one fact
+            [msg, self.reason] = b.forget(join(quote.split()[1:], " "))
+            self.say(msg)
 
         elif (cmd[0] == "FORGET"):
-            print "FORGOTTEN"
-            b = brain()
-            reason = []
+            b.clear()
+            self.reason = []
+            self.say("FORGOTTEN")
 
         elif (cmd[0] == "WHY"):
+            reason = self.reason
             if (len(reason) == 0):
-                print "*SHRUG*"
+                self.say("*SHRUG*")
             elif (len(reason) == 1):
                 if (reason[0].subj == reason[0].obj):
                     if (reason[0].negative == 0):
-                        print "WHAT ELSE WOULD", reason[0].subj_adj, reason[0].subj, "BE?"
+                        self.say("WHAT ELSE WOULD", reason[0].subj_adj, reason[0].subj, "BE?")
                     else:
-                        print reason[0].subj, reason[0].orig_verb, reason[0].obj+", THROUGH AND THROUGH"
+                        self.say(reason[0].subj, reason[0].orig_verb, reason[0].obj+", THROUGH AND THROUGH")
                 else:
-                    print "YOU SAID EARLIER THAT", reason[0].swap_person()
+                    self.say("YOU SAID EARLIER THAT", reason[0].swap_person())
             else:
-                print "BECAUSE:"
+                self.say("BECAUSE:")
                 for r in reason:
-                    print " ", r.swap_person()
+                    self.say(" ", r.swap_person())
+
+        elif (cmd[0] == "WHAT" or cmd[0] == "WHO"):
+            # Ask the question about an unknown subject
+            f = fact("SOMETHING "+join(quote.split()[1:], " "))
+            if (f.error != "" or f.subj != "SOMETHING" or f.verb == ""
+                or (f.verb == "IS" and f.obj == "")):
+                self.say("I DON'T UNDERSTAND")
+            else:
+                count = 0
+                for word in b.subjects(f.verb, f.obj, f.negative):
+                    self.say(word)
+                    count += 1
+                if (count == 0):
+                    self.say("NOTHING THAT I KNOW OF")
+            self.reason = []
+
+        elif (cmd[0] == "STATS"):
+            if (len(cmd) > 2):
+                self.say("** Usage: STATS [ON|OFF|RESET]")
+            elif (len(cmd) == 2 and cmd[1].upper() == "ON"):
+                b.instrument = 1
+                self.say("OK")
+            elif (len(cmd) == 2 and cmd[1].upper() == "OFF"):
+                b.instrument = 0
+                self.say("OK")
+            elif (len(cmd) == 2 and cmd[1].upper() == "RESET"):
+                b.reset_stats()
+                self.say("OK")
+            elif (len(cmd) == 2):
+                self.say("** Usage: STATS [ON|OFF|RESET]")
+            else:
+                totals = b.stats()
+                if (not totals):
+                    if (b.instrument):
+                        self.say("NOTHING COUNTED YET")
+                    else:
+                        self.say("NOT COUNTING (STATS ON TO START)")
+                for operation in ("learn", "query", "describe"):
+                    if (totals.has_key(operation)):
+                        t = totals[operation]
+                        self.say(upper(operation)+":", t["count"], "TIMES,",
+                                 t["nodes"], "NODES,", t["deepest"], "DEEP,",
+                                 t["copied"], "FACTS COPIED,",
+                                 "%.6f" % t["seconds"], "SECONDS")
+
+        elif (cmd[0] == "SHORTEST"):
+            if (len(cmd) != 2):
+                self.say("** Usage: SHORTEST ON|OFF|<n>")
+            elif (cmd[1].upper() == "ON"):
+                b.shortest = 1
+                b.proof_limit = 0
+                self.say("OK")
+            elif (cmd[1].upper() == "OFF"):
+                b.shortest = 0
+                self.say("OK")
+            elif (cmd[1].isdigit() and int(cmd[1]) > 0):
+                b.shortest = 1
+                b.proof_limit = int(cmd[1])
+                self.say("OK")
+            else:
+                self.say("** Usage: SHORTEST ON|OFF|<n>")
 
         elif (cmd[0] == "ABOUT"):
-            print "Deduce 1.3.0, Copyright (C) 1995-2004  James Williams"
-            print "This program is licensed under the GNU General Public"
-            print "Licence (GPL) and may be distributed freely.  This"
-            print "program comes with ABSOLUTELY NO WARRANTY.  For details,"
-            print "please refer to the file COPYING, which should have"
-            print "been included with this program."
+            self.say("Deduce 1.3.0, Copyright (C) 1995-2004  James Williams")
+            self.say("This program is licensed under the GNU General Public")
+            self.say("Licence (GPL) and may be distributed freely.  This")
+            self.say("program comes with ABSOLUTELY NO WARRANTY.  For details,")
+            self.say("please refer to the file COPYING, which should have")
+            self.say("been included with this program.")
             
         elif (cmd[0] == "QUIT"
               or cmd[0] == "EXIT"
               or cmd[0] == "BYE"
               or cmd[0] == "STOP"):
-            print "GOODBYE"
-            return
+            self.say("GOODBYE")
+            return 0
 
         elif (len(cmd) == 1):
-            print "** Unknown command"
+            self.say("** Unknown command")
 
         else:
             f = fact(quote)
             if (f.question == 0):
                 # Stating a fact
-                [msg, reason] = b.learn(quote)
-                print msg
+                [msg, self.reason] = b.learn(f)
+                self.say(msg)
             else:
                 # Asking a question
-                [ans, ans_str, reason] = b.query(quote)
-                print ans_str
-    
+                [ans, ans_str, self.reason] = b.query(f)
+                self.say(ans_str)
+
+        return 1
+
+##
+## This is where the user interface is defined.  It prompts the user for
+## input a line at a time.  The user can enter sentences (facts or
+## questions), or commands.
+##
+## Inputs:
+##   b: A brain object to store and retrieve information
+##
+## Returns:
+##   none
+##
+def ui():
+    s = session(brain(), sys.stdout)
+
+    while (1):
+        sys.stdout.write("\n> ")
+        quote = sys.stdin.readline()
+        if (quote == ""):
+            # End of input
+            return
+        if (not s.command(quote)):
+            return
+
+# What a reply to a statement means, for batch(): 1 learned, 0 known
+learn_codes = { "OK": 1, "WELL, OK": 1, "YEAH, I KNOW": 0 }
+
+##
+## Run a script of statements, questions and commands without prompting,
+## writing one JSON object per line of the script:
+##
+##   {"line": 3, "type": "question", "code": 1,
+##    "text": "YES, TOM IS AN ANIMAL", "reason": ["TOM IS A CAT", ...]}
+##
+## The code is the answer to a question (1 yes, 0 no, -1 don't know),
+## or for a statement 1 if it was learned, 0 if it was known already and
+## -1 if it was refused.  A command's code is 1, and its text is what it
+## would have printed.  Blank lines are skipped.  A line that raises an
+## exception gets a result of type "error" with code -1 and the error as
+## its text, and the script goes on.
+##
+## The script is read as it goes.  A run of questions is answered in
+## chunks by query_many, and results are written out a chunk at a time.
+##
+## Inputs:
+##   b: The brain to use
+##   infile: The script, as a file or any iterable of lines
+##   out: A file to write the results to
+##   chunk: The most questions to answer, or results to hold, at once
+##
+## Returns:
+##   The number of lines run
+##
+def batch(b, infile, out, chunk=1000):
+    s = session(b, None)
+    results = []
+    pending = []
+    count = 0
+
+    for [lineno, quote] in enumerate(infile):
+        quote = quote.strip()
+        if (quote == ""):
+            continue
+        count += 1
+
+        if (s.is_command(quote)):
+            # Commands see everything before them
+            batch_answer(s, pending, results, chunk)
+            s.out = StringIO()
+            try:
+                more = s.command(quote)
+            except Exception, err:
+                results.append(batch_error(lineno + 1, err))
+                more = 1
+            else:
+                results.append({ "line": lineno + 1, "type": "command",
+                                 "code": 1,
+                                 "text": s.out.getvalue().rstrip("\n"),
+                                 "reason": [] })
+            s.out = None
+            if (not more):
+                break
+        else:
+            try:
+                f = fact(quote)
+            except Exception, err:
+                f = None
+                batch_answer(s, pending, results, chunk)
+                results.append(batch_error(lineno + 1, err))
+
+            if (f is None):
+                pass
+            elif (f.question):
+                pending.append([lineno + 1, f])
+                if (len(pending) >= chunk):
+                    batch_answer(s, pending, results, chunk)
+            else:
+                batch_answer(s, pending, results, chunk)
+                try:
+                    [msg, s.reason] = b.learn(f)
+                except Exception, err:
+                    results.append(batch_error(lineno + 1, err))
+                else:
+                    results.append({ "line": lineno + 1, "type": "statement",
+                                     "code": learn_codes.get(msg, -1),
+                                     "text": msg,
+                                     "reason": [ r.__str__() for r in s.reason ] })
+
+        if (len(results) >= chunk):
+            batch_write(results, out)
+
+    batch_answer(s, pending, results, chunk)
+    batch_write(results, out)
+    out.flush()
+    return count
+
+##
+## Make batch()'s result for a line that raised an exception
+##
+## Inputs:
+##   lineno: The line number
+##   err: The exception
+##
+## Returns:
+##   A result dictionary
+##
+def batch_error(lineno, err):
+    return { "line": lineno, "type": "error", "code": -1,
+             "text": "%s: %s" % (err.__class__.__name__, err),
+             "reason": [] }
+
+##
+## Answer batch()'s waiting questions
+##
+## Inputs:
+##   s: The batch's session
+##   pending: A list of [line number, question] pairs, emptied here
+##   results: The list of results to add the answers to
+##   chunk: The most questions to answer at once
+##
+## Returns:
+##   none
+##
+def batch_answer(s, pending, results, chunk):
+    if (len(pending) == 0):
+        return
+    questions = [ q for [lineno, q] in pending ]
+    answers = s.brain.query_many(questions, chunk=chunk)
+    for [[lineno, q], [ans, ans_str, reason]] in zip(pending, answers):
+        results.append({ "line": lineno, "type": "question", "code": ans,
+                         "text": ans_str,
+                         "reason": [ r.__str__() for r in reason ] })
+        s.reason = reason
+    del pending[:]
+
+##
+## Write out and forget batch()'s results so far
+##
+## Inputs:
+##   results: The list of results, emptied here
+##   out: The file to write them to
+##
+## Returns:
+##   none
+##
+def batch_write(results, out):
+    out.write(join([ json.dumps(r, sort_keys=True) + "\n"
+                     for r in results ], ""))
+    del results[:]
+
+###########################################################################
+##
+## Serving a brain over the network.  Each connection gets a thread and
+## a session of its own, and sends the same lines that would be typed at
+## ui(); each reply is written back before the next line is read, so a
+## client that doesn't read its replies only holds up itself.  Questions
+## from different connections are answered at the same time, and new
+## facts are learned one at a time, by way of the brain's lock.
+##
+###########################################################################
+max_line = 65536
+
+class session_handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        s = session(self.server.brain, self.wfile)
+        while (1):
+            quote = self.rfile.readline(max_line)
+            if (quote == ""):
+                return
+            try:
+                if (not s.command(quote)):
+                    return
+            except socket.error:
+                # The client went away
+                return
+            except Exception, err:
+                # A line that goes wrong doesn't cost the client its
+                # connection
+                try:
+                    s.say("** Error:", err)
+                except socket.error:
+                    return
+
+class tcp_server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    ##
+    ## Initialize a server on a TCP port
+    ##
+    ## Inputs:
+    ##   address: A (host, port) tuple to listen on
+    ##   b: The brain to serve, or None for a new one
+    ##
+    ## Returns:
+    ##   a tcp_server object
+    ##
+    def __init__(self, address, b=None):
+        if (b is None):
+            b = brain()
+        self.brain = b
+        SocketServer.TCPServer.__init__(self, address, session_handler)
+
+class unix_server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    ##
+    ## Initialize a server on a Unix socket
+    ##
+    ## Inputs:
+    ##   address: The path of the socket, which must not exist yet
+    ##   b: The brain to serve, or None for a new one
+    ##
+    ## Returns:
+    ##   a unix_server object
+    ##
+    def __init__(self, address, b=None):
+        if (b is None):
+            b = brain()
+        self.brain = b
+        SocketServer.UnixStreamServer.__init__(self, address, session_handler)
+
+##
+## Serve a brain until interrupted
+##
+## Inputs:
+##   address: A (host, port) tuple for TCP, or the path of a Unix socket
+##   b: The brain to serve, or None for a new one
+##
+## Returns:
+##   none
+##
+def serve(address, b=None):
+    if (type(address) == type("")):
+        server = unix_server(address, b)
+    else:
+        server = tcp_server(address, b)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if (type(address) == type("")):
+            os.unlink(address)
 
 ### MAIN ###
 if __name__ == "__main__":
-    print "HI, I'M DEDUCE.  FILL MY HEAD WITH TRIVIA, THEN QUIZ ME ON IT."
-    print "I'M A GOOD LISTENER.  REALLY I AM."
-    ui()
+    if (len(sys.argv) == 3 and sys.argv[1] == "--serve"):
+        # --serve <port> or --serve <socket path>
+        if (sys.argv[2].isdigit()):
+            serve(("localhost", int(sys.argv[2])))
+        else:
+            serve(sys.argv[2])
+    elif (len(sys.argv) in (2, 3) and sys.argv[1] == "--batch"):
+        # --batch [script], reading standard input without one or with -
+        if (len(sys.argv) == 3 and sys.argv[2] != "-"):
+            infile = file(sys.argv[2])
+        else:
+            infile = sys.stdin
+        batch(brain(), infile, sys.stdout)
+    else:
+        print "HI, I'M DEDUCE.  FILL MY HEAD WITH TRIVIA, THEN QUIZ ME ON IT."
+        print "I'M A GOOD LISTENER.  REALLY I AM."
+        ui()
 
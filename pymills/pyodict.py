@@ -1,5 +1,7 @@
 # Python Software Foundation License
 
+from itertools import islice, izip
+
 class _Nil(object):
     
     def __repr__(self):
@@ -16,15 +18,162 @@ class _Nil(object):
             return False
         else:
             return NotImplemented
+
+    def __reduce__(self):
+        """Unpickle as the module's _nil, which is compared by identity.
+        """
+        return '_nil'
         
 _nil = _Nil()
 
+def _sorted_keys(d, cmp, key, reverse):
+    """The keys of an ordered dict in the order its sort() puts them in.
+    cmp and key work on (key, value) pairs; with neither, the values are
+    compared.
+    """
+    keys = d.keys()
+    if cmp is None and key is None:
+        keys.sort(key=d.__getitem__)
+    else:
+        if key is None:
+            cmpkey = lambda k: (k, d[k])
+        else:
+            cmpkey = lambda k: key((k, d[k]))
+        keys.sort(cmp=cmp, key=cmpkey)
+    if reverse:
+        keys.reverse()
+    return keys
+
+def _fenwick(keys):
+    """Build a Fenwick tree over a list of slots, counting the ones that
+    are not tombstones: node i counts the live slots from i - (i & -i)
+    up to i - 1.
+    """
+    tree = [0] * (len(keys) + 1)
+    for i in xrange(1, len(tree)):
+        if keys[i - 1] is not _nil:
+            tree[i] += 1
+        parent = i + (i & -i)
+        if parent < len(tree):
+            tree[parent] += tree[i]
+    return tree
+
+def _fenwick_append(tree):
+    """Add a node to a Fenwick tree for a new, live, last slot.
+    """
+    i = len(tree)
+    # It covers its own slot and the nodes just below it
+    count = 1
+    child = i - 1
+    low = i - (i & -i)
+    while child > low:
+        count += tree[child]
+        child -= child & -child
+    tree.append(count)
+
+def _fenwick_add(tree, slot, delta):
+    i = slot + 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+def _fenwick_before(tree, slot):
+    """Number of live slots before slot.
+    """
+    count = 0
+    i = slot
+    while i > 0:
+        count += tree[i]
+        i -= i & -i
+    return count
+
+def _fenwick_find(tree, i):
+    """Slot of the live slot at position i, which must be in range.
+    """
+    slot = 0
+    step = 1 << ((len(tree) - 1).bit_length() - 1)
+    while step:
+        if slot + step < len(tree) and tree[slot + step] <= i:
+            slot += step
+            i -= tree[slot]
+        step //= 2
+    return slot
+
+class _order(object):
+    """Positions of the keys of an _odict, for index(), at() and islice().
+
+    The keys are kept in order in a list of slots, with tombstones where
+    keys were taken out, along with a dict from each key to its slot and
+    a Fenwick tree counting the live slots.  There is room before the
+    first key for keys moved to the front, and the slots are laid out
+    again once tombstones outnumber the live ones.
+    """
+
+    def __init__(self, keys):
+        self._layout(list(keys))
+
+    def _layout(self, keys):
+        room = len(keys) // 4 + 1
+        self.keys = [_nil] * room + keys
+        self.slots = dict((key, room + i) for i, key in enumerate(keys))
+        self.head = room
+        self.deleted = room
+        self.tree = _fenwick(self.keys)
+
+    def append(self, key):
+        self.slots[key] = len(self.keys)
+        self.keys.append(key)
+        _fenwick_append(self.tree)
+
+    def prepend(self, key):
+        if self.head == 0:
+            self._layout(list(self.iterkeys()))
+        self.head -= 1
+        self.deleted -= 1
+        self.keys[self.head] = key
+        self.slots[key] = self.head
+        _fenwick_add(self.tree, self.head, 1)
+
+    def remove(self, key):
+        slot = self.slots.pop(key)
+        keys = self.keys
+        keys[slot] = _nil
+        self.deleted += 1
+        _fenwick_add(self.tree, slot, -1)
+        if slot == self.head:
+            head = slot + 1
+            while head < len(keys) and keys[head] is _nil:
+                head += 1
+            self.head = head
+        if self.deleted > 8 and self.deleted * 2 > len(keys):
+            self._layout(list(self.iterkeys()))
+
+    def iterkeys(self, start=None):
+        if start is None:
+            start = self.head
+        for key in islice(self.keys, start, None):
+            if key is not _nil:
+                yield key
+
+    def index(self, key):
+        return _fenwick_before(self.tree, self.slots[key])
+
+    def at(self, i):
+        return self.keys[_fenwick_find(self.tree, i)]
+
+    def islice(self, start, stop):
+        return islice(self.iterkeys(_fenwick_find(self.tree, start)),
+                      stop - start)
+
 class _odict(object):
     """Ordered dict data structure, with O(1) complexity for dict operations
     that modify one element.
     
     Overwriting values doesn't change their original sequential order.
     """
+
+    # The positions of the keys, or None until one is asked for
+    _pos = None
     
     def _dict_impl(self):
         return None
@@ -87,6 +236,8 @@ class _odict(object):
                 dict_impl.__getitem__(
                     self, dict_impl.__getattribute__(self, 'lt'))[2] = key
             dict_impl.__setattr__(self, 'lt', key)
+            if self._pos is not None:
+                self._pos.append(key)
 
     def __delitem__(self, key):
         dict_impl = self._dict_impl()
@@ -100,12 +251,22 @@ class _odict(object):
         else:
             dict_impl.__getitem__(self, succ)[0] = pred
         dict_impl.__delitem__(self, key)
+        if self._pos is not None:
+            self._pos.remove(key)
     
     def __contains__(self, key):
-        return key in self.keys()
+        return self._dict_impl().__contains__(self, key)
     
     def __len__(self):
-        return len(self.keys())
+        return self._dict_impl().__len__(self)
+
+    def __getstate__(self):
+        """Pickles leave out the positions of the keys, which are worked
+        out again when they are needed.
+        """
+        state = self.__dict__.copy()
+        state.pop('_pos', None)
+        return state
 
     def __str__(self):
         pairs = ("%r: %r" % (k, v) for k, v in self.iteritems())
@@ -119,9 +280,9 @@ class _odict(object):
             return "odict()"
     
     def get(self, k, x=None):
-        if k in self:
+        try:
             return self._dict_impl().__getitem__(self, k)[1]
-        else:
+        except KeyError:
             return x
 
     def __iter__(self):
@@ -158,27 +319,69 @@ class _odict(object):
         return list(self.iteritems())
     
     def sort(self, cmp=None, key=None, reverse=False):
-        cmpkey = key
-        items = [(key, value) for key, value in self.items()]
-        if cmp is None and cmpkey is None:
-            def cmp(x, y):
-                if x[1] < y[1]: return -1
-                if x[1] > y[1]: return 1
-                return 0
-        if cmp is not None:
-            items = sorted(items, cmp=cmp)
+        """Sort in place, by relinking the nodes.
+        """
+        keys = _sorted_keys(self, cmp, key, reverse)
+        if not keys:
+            return
+        dict_impl = self._dict_impl()
+        pred = _nil
+        for curr_key in keys:
+            node = dict_impl.__getitem__(self, curr_key)
+            node[0] = pred
+            if pred != _nil:
+                dict_impl.__getitem__(self, pred)[2] = curr_key
+            pred = curr_key
+        dict_impl.__getitem__(self, pred)[2] = _nil
+        dict_impl.__setattr__(self, 'lh', keys[0])
+        dict_impl.__setattr__(self, 'lt', pred)
+        self._pos = None
+
+    def move_to_end(self, key, last=True):
+        """Move an existing key to the end, or to the front if last is
+        false.
+        """
+        dict_impl = self._dict_impl()
+        node = dict_impl.__getitem__(self, key)
+        if last:
+            if dict_impl.__getattribute__(self, 'lt') == key:
+                return
+            _odict.__delitem__(self, key)
+            tail = dict_impl.__getattribute__(self, 'lt')
+            node[0], node[2] = tail, _nil
+            if tail == _nil:
+                dict_impl.__setattr__(self, 'lh', key)
+            else:
+                dict_impl.__getitem__(self, tail)[2] = key
+            dict_impl.__setattr__(self, 'lt', key)
+            if self._pos is not None:
+                self._pos.append(key)
         else:
-            items = sorted(items, key=cmpkey)
-        if reverse:
-            items.reverse()
-        self.clear()
-        self.__init__(items)
+            if dict_impl.__getattribute__(self, 'lh') == key:
+                return
+            _odict.__delitem__(self, key)
+            head = dict_impl.__getattribute__(self, 'lh')
+            node[0], node[2] = _nil, head
+            if head == _nil:
+                dict_impl.__setattr__(self, 'lt', key)
+            else:
+                dict_impl.__getitem__(self, head)[0] = key
+            dict_impl.__setattr__(self, 'lh', key)
+            if self._pos is not None:
+                self._pos.prepend(key)
+        dict_impl.__setitem__(self, key, node)
+
+    def move_to_front(self, key):
+        """Move an existing key to the front.
+        """
+        self.move_to_end(key, last=False)
 
     def clear(self):
         dict_impl = self._dict_impl()
         dict_impl.clear(self)
         dict_impl.__setattr__(self, 'lh', _nil)
         dict_impl.__setattr__(self, 'lt', _nil)
+        self._pos = None
 
     def copy(self):
         return self.__class__(self)
@@ -285,6 +488,41 @@ class _odict(object):
         else:
             raise KeyError("'lastkey(): ordered dictionary is empty'")
     
+    def _positions(self):
+        """The positions of the keys, worked out the first time they are
+        needed and kept up to date from then on, until a sort or clear.
+        """
+        if self._pos is None:
+            self._pos = _order(self.iterkeys())
+        return self._pos
+
+    def index(self, key):
+        """Position of key in the order, in O(log n).
+        """
+        if not self._dict_impl().__contains__(self, key):
+            raise ValueError("%r is not in ordered dictionary" % (key,))
+        return self._positions().index(key)
+
+    def at(self, i):
+        """Key at position i, counting from the end if i is negative, in
+        O(log n).
+        """
+        size = len(self)
+        if i < 0:
+            i += size
+        if i < 0 or i >= size:
+            raise IndexError("ordered dictionary index out of range")
+        return self._positions().at(i)
+
+    def islice(self, start=None, stop=None):
+        """To iterate on the keys from position start up to stop, which
+        are taken as they would be in a slice.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return iter(())
+        return self._positions().islice(start, stop)
+
     def as_dict(self):
         return self._dict_impl()(self.items())
 
@@ -302,3 +540,408 @@ class odict(_odict, dict):
     
     def _dict_impl(self):
         return dict
+
+class _codict(object):
+    """Ordered dict kept compactly, the way CPython 3.6 keeps its dicts.
+
+    Keys and values are appended to two dense lists in insertion order,
+    and the dict itself maps each key to its slot in them.  Deleting a
+    key leaves a tombstone in its slot; the lists are compacted once
+    tombstones outnumber the live slots.  This takes far less memory and
+    time per key than _odict, with the same API.
+
+    Positions (index, at, islice) come from a Fenwick tree counting the
+    live slots, which is built the first time one is asked for and then
+    kept up to date, so each takes O(log n).
+    """
+
+    # The attributes are slots in codict, which pickles by __reduce__
+    __slots__ = ()
+
+    def _dict_impl(self):
+        return None
+
+    def __init__(self, data=(), **kwds):
+        """This doesn't accept keyword initialization as normal dicts to avoid
+        a trap - inside a function or method the keyword args are accessible
+        only as a dict, without a defined order, so their original order is
+        lost.
+        """
+        if kwds:
+            raise TypeError("__init__() of ordered dict takes no keyword "
+                            "arguments to avoid an ordering trap.")
+        self._dict_impl().__init__(self)
+        self._keys = []
+        self._values = []
+        # The first slot that may be live, and the number of tombstones
+        self._head = 0
+        self._deleted = 0
+        # The Fenwick tree over the slots, or None until it is needed
+        self._rank = None
+        # If you give a normal dict, then the order of elements is undefined
+        if hasattr(data, "iteritems"):
+            for key, val in data.iteritems():
+                self[key] = val
+        else:
+            for key, val in data:
+                self[key] = val
+
+    def __getitem__(self, key):
+        return self._values[self._dict_impl().__getitem__(self, key)]
+
+    def __setitem__(self, key, val):
+        dict_impl = self._dict_impl()
+        try:
+            self._values[dict_impl.__getitem__(self, key)] = val
+        except KeyError, e:
+            dict_impl.__setitem__(self, key, len(self._keys))
+            self._keys.append(key)
+            self._values.append(val)
+            if self._rank is not None:
+                _fenwick_append(self._rank)
+
+    def __delitem__(self, key):
+        dict_impl = self._dict_impl()
+        slot = dict_impl.__getitem__(self, key)
+        dict_impl.__delitem__(self, key)
+        keys = self._keys
+        values = self._values
+        if slot == len(keys) - 1:
+            keys.pop()
+            values.pop()
+            while keys and keys[-1] is _nil:
+                keys.pop()
+                values.pop()
+                self._deleted -= 1
+            if self._head > len(keys):
+                self._head = len(keys)
+            if self._rank is not None:
+                # No node of the tree covers a slot after its own
+                del self._rank[len(keys) + 1:]
+        else:
+            keys[slot] = _nil
+            values[slot] = None
+            self._deleted += 1
+            if self._rank is not None:
+                _fenwick_add(self._rank, slot, -1)
+            if slot == self._head:
+                head = slot + 1
+                while keys[head] is _nil:
+                    head += 1
+                self._head = head
+            if self._deleted > 8 and self._deleted * 2 > len(keys):
+                self._compact()
+
+    def _compact(self, room=0):
+        """Squeeze the tombstones out of the slot lists, leaving room
+        tombstones at the front.
+        """
+        dict_impl = self._dict_impl()
+        keys = [_nil] * room
+        values = [None] * room
+        for key, val in self.iteritems():
+            dict_impl.__setitem__(self, key, len(keys))
+            keys.append(key)
+            values.append(val)
+        self._keys = keys
+        self._values = values
+        self._head = room
+        self._deleted = room
+        self._rank = None
+
+    def __contains__(self, key):
+        return self._dict_impl().__contains__(self, key)
+
+    def __len__(self):
+        return self._dict_impl().__len__(self)
+
+    def __eq__(self, other):
+        if isinstance(other, _codict):
+            return self.items() == other.items()
+        elif isinstance(other, dict):
+            return self.as_dict() == other
+        else:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __reduce__(self):
+        return (self.__class__, (self.items(),))
+
+    def __str__(self):
+        pairs = ("%r: %r" % (k, v) for k, v in self.iteritems())
+        return "{%s}" % ", ".join(pairs)
+
+    def __repr__(self):
+        if self:
+            pairs = ("(%r, %r)" % (k, v) for k, v in self.iteritems())
+            return "codict([%s])" % ", ".join(pairs)
+        else:
+            return "codict()"
+
+    def get(self, k, x=None):
+        try:
+            return self._values[self._dict_impl().__getitem__(self, k)]
+        except KeyError:
+            return x
+
+    def __iter__(self):
+        for key in islice(self._keys, self._head, None):
+            if key is not _nil:
+                yield key
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        head = self._head
+        for key, val in izip(islice(self._keys, head, None),
+                             islice(self._values, head, None)):
+            if key is not _nil:
+                yield val
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        head = self._head
+        for key, val in izip(islice(self._keys, head, None),
+                             islice(self._values, head, None)):
+            if key is not _nil:
+                yield key, val
+
+    def items(self):
+        return list(self.iteritems())
+
+    def sort(self, cmp=None, key=None, reverse=False):
+        """Sort in place, laying the slots out afresh.
+        """
+        keys = _sorted_keys(self, cmp, key, reverse)
+        dict_impl = self._dict_impl()
+        values = self._values
+        self._values = [values[dict_impl.__getitem__(self, key)]
+                        for key in keys]
+        self._keys = keys
+        self._head = 0
+        self._deleted = 0
+        self._rank = None
+        for slot, key in enumerate(keys):
+            dict_impl.__setitem__(self, key, slot)
+
+    def move_to_end(self, key, last=True):
+        """Move an existing key to the end, or to the front if last is
+        false.
+        """
+        if not last:
+            self.move_to_front(key)
+            return
+        dict_impl = self._dict_impl()
+        slot = dict_impl.__getitem__(self, key)
+        if slot == len(self._keys) - 1:
+            return
+        val = self._values[slot]
+        _codict.__delitem__(self, key)
+        _codict.__setitem__(self, key, val)
+
+    def move_to_front(self, key):
+        """Move an existing key to the front.  The slot before the first
+        key is always a tombstone; when there is none, the slots are laid
+        out again with room at the front.
+        """
+        dict_impl = self._dict_impl()
+        slot = dict_impl.__getitem__(self, key)
+        if slot == self._head:
+            return
+        if self._head == 0:
+            self._compact(len(self) // 4 + 1)
+            slot = dict_impl.__getitem__(self, key)
+        keys = self._keys
+        values = self._values
+        head = self._head - 1
+        keys[head], values[head] = key, values[slot]
+        keys[slot], values[slot] = _nil, None
+        dict_impl.__setitem__(self, key, head)
+        self._head = head
+        if self._rank is not None:
+            _fenwick_add(self._rank, slot, -1)
+            _fenwick_add(self._rank, head, 1)
+        if slot == len(keys) - 1:
+            while keys[-1] is _nil:
+                keys.pop()
+                values.pop()
+                self._deleted -= 1
+            if self._rank is not None:
+                del self._rank[len(keys) + 1:]
+
+    def clear(self):
+        self._dict_impl().clear(self)
+        self._keys = []
+        self._values = []
+        self._head = 0
+        self._deleted = 0
+        self._rank = None
+
+    def copy(self):
+        return self.__class__(self)
+
+    def update(self, data=(), **kwds):
+        if kwds:
+            raise TypeError("update() of ordered dict takes no keyword "
+                            "arguments to avoid an ordering trap.")
+        if hasattr(data, "iteritems"):
+            for key, val in data.iteritems():
+                self[key] = val
+        else:
+            for key, val in data:
+                self[key] = val
+
+    @classmethod
+    def fromkeys(cls, seq, value=None):
+        new = cls()
+        for key in seq:
+            new[key] = value
+        return new
+
+    def setdefault(self, k, x=None):
+        try:
+            return self[k]
+        except KeyError:
+            self[k] = x
+            return x
+
+    def pop(self, k, x=_nil):
+        try:
+            val = self[k]
+        except KeyError:
+            if x == _nil:
+                raise
+            return x
+        del self[k]
+        return val
+
+    def popitem(self):
+        if self:
+            key = self._keys[-1]
+            val = self._values[-1]
+            self.__delitem__(key)
+            return key, val
+        else:
+            raise KeyError("'popitem(): ordered dictionary is empty'")
+
+    def riterkeys(self):
+        """To iterate on keys in reversed order.
+        """
+        keys = self._keys
+        for slot in xrange(len(keys) - 1, self._head - 1, -1):
+            key = keys[slot]
+            if key is not _nil:
+                yield key
+
+    __reversed__ = riterkeys
+
+    def rkeys(self):
+        """List of the keys in reversed order.
+        """
+        return list(self.riterkeys())
+
+    def ritervalues(self):
+        """To iterate on values in reversed order.
+        """
+        keys = self._keys
+        values = self._values
+        for slot in xrange(len(keys) - 1, self._head - 1, -1):
+            if keys[slot] is not _nil:
+                yield values[slot]
+
+    def rvalues(self):
+        """List of the values in reversed order.
+        """
+        return list(self.ritervalues())
+
+    def riteritems(self):
+        """To iterate on (key, value) in reversed order.
+        """
+        keys = self._keys
+        values = self._values
+        for slot in xrange(len(keys) - 1, self._head - 1, -1):
+            key = keys[slot]
+            if key is not _nil:
+                yield key, values[slot]
+
+    def ritems(self):
+        """List of the (key, value) in reversed order.
+        """
+        return list(self.riteritems())
+
+    def firstkey(self):
+        if self:
+            return self._keys[self._head]
+        else:
+            raise KeyError("'firstkey(): ordered dictionary is empty'")
+
+    def lastkey(self):
+        if self:
+            return self._keys[-1]
+        else:
+            raise KeyError("'lastkey(): ordered dictionary is empty'")
+
+    def index(self, key):
+        """Position of key in the order.
+        """
+        try:
+            slot = self._dict_impl().__getitem__(self, key)
+        except KeyError:
+            raise ValueError("%r is not in ordered dictionary" % (key,))
+        if self._rank is None:
+            self._rank = _fenwick(self._keys)
+        return _fenwick_before(self._rank, slot)
+
+    def at(self, i):
+        """Key at position i, counting from the end if i is negative.
+        """
+        size = len(self)
+        if i < 0:
+            i += size
+        if i < 0 or i >= size:
+            raise IndexError("ordered dictionary index out of range")
+        if self._rank is None:
+            self._rank = _fenwick(self._keys)
+        return self._keys[_fenwick_find(self._rank, i)]
+
+    def islice(self, start=None, stop=None):
+        """To iterate on the keys from position start up to stop, which
+        are taken as they would be in a slice.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return iter(())
+        if self._rank is None:
+            self._rank = _fenwick(self._keys)
+        slot = _fenwick_find(self._rank, start)
+        keys = (key for key in islice(self._keys, slot, None)
+                if key is not _nil)
+        return islice(keys, stop - start)
+
+    def as_dict(self):
+        return self._dict_impl()(self.iteritems())
+
+    def _repr(self):
+        """_repr(): low level repr of the whole data contained in the codict.
+        Useful for debugging.
+        """
+        dict_impl = self._dict_impl()
+        form = "codict low level repr keys,values,index: %r, %r, %s"
+        return form % (self._keys, self._values, dict_impl.__repr__(self))
+
+class codict(_codict, dict):
+
+    __slots__ = ("_keys", "_values", "_head", "_deleted", "_rank")
+
+    def _dict_impl(self):
+        return dict
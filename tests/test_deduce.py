@@ -0,0 +1,927 @@
+from random import Random
+
+from pymills.ai.deduce import brain
+
+
+def random_sentences(seed, names, facts):
+    random = Random(seed)
+    for i in range(facts):
+        subj, obj = random.choice(names), random.choice(names)
+        if random.random() < 0.2:
+            yield "%s is not a %s" % (subj, obj)
+        else:
+            yield "%s is a %s" % (subj, obj)
+
+
+def random_brain(seed, words=10, facts=30, **kwargs):
+    names = ["W%d" % i for i in range(words)]
+    b = brain(**kwargs)
+    for sentence in random_sentences(seed, names, facts):
+        b.learn(sentence)
+    return names, b
+
+
+def answer(b, question):
+    ans, text, reason = b.query(question)
+    return ans, text, [str(r) for r in reason]
+
+
+def test_is_index():
+    b = brain()
+    b.learn("Spot is a dog")
+    b.learn("A dog is an animal")
+    b.learn("An animal is not a plant")
+
+    assert "ANIMAL" in b.is_up["SPOT"]
+    assert "SPOT" in b.is_down["ANIMAL"]
+    assert b.is_answerable("SPOT", "PLANT")
+    assert not b.is_answerable("ANIMAL", "SPOT")
+
+    assert b.query("Is Spot an animal?")[0] == 1
+    assert b.query("Is Spot a plant?")[0] == 0
+
+
+def test_is_index_matches_recursive_search():
+    for seed in range(10):
+        names, indexed = random_brain(seed)
+        _, plain = random_brain(seed, index=0)
+        assert str(indexed) == str(plain)
+        for subj in names:
+            for obj in names:
+                question = "Is %s a %s?" % (subj, obj)
+                assert answer(indexed, question) == answer(plain, question)
+
+
+def test_object_cycle():
+    b = brain()
+    b.learn("A dog is a canine")
+    b.learn("A canine is a dog")
+    b.learn("Spot likes cats")
+    assert b.query("Does Spot likes a dog?")[0] == -1
+
+
+def test_same_fact_for_subject_and_object():
+    # "Spot is a dog" stands in for both sides of the question
+    for index in (0, 1):
+        b = brain(index=index)
+        b.learn("Spot is a dog")
+        b.learn("A dog likes dog")
+        ans, text, reason = b.query("Does Spot likes Spot?")
+        assert ans == 1
+        assert [str(r) for r in reason] == [
+            "SPOT IS A DOG", "SPOT IS A DOG", "A DOG LIKES DOG"
+        ]
+        assert b.learn("Spot likes Spot")[0] == "YEAH, I KNOW"
+
+
+def test_concurrent_queries():
+    from threading import Thread
+
+    names, b = random_brain(1)
+    _, reference = random_brain(1)
+    questions = ["Is %s a %s?" % (s, o) for s in names for o in names]
+    expected = [answer(reference, q) for q in questions]
+    errors = []
+
+    def reader():
+        for question, answered in zip(questions, expected):
+            if answer(b, question) != answered:
+                errors.append(question)
+
+    def writer():
+        for i in range(20):
+            b.learn("X%d likes fish" % i)
+
+    threads = [Thread(target=reader) for i in range(4)]
+    threads.append(Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert b.query("Does X19 likes fish?")[0] == 1
+
+
+def test_learn_many():
+    b = brain()
+    learned, conflicts = b.learn_many([
+        "Spot is a dog",
+        "",
+        "A dog is an animal",
+        "An animal is not a plant",
+        "Spot is a plant",
+        "Spot is a dog",
+        "Spot is an animal",
+        "Spot is not Spot",
+    ])
+
+    assert learned == 3
+    assert [(c[0], c[2]) for c in conflicts] == [
+        (5, "THAT CAN'T BE RIGHT"),
+        (8, "I'M NOT BUYING IT"),
+    ]
+    assert [str(r) for r in conflicts[0][3]] == [
+        "SPOT IS A DOG", "A DOG IS AN ANIMAL", "AN ANIMAL IS NOT A PLANT"
+    ]
+    assert b.query("Is Spot a plant?")[0] == 0
+    assert b.query("Is Spot an animal?")[0] == 1
+
+    for seed in range(5):
+        names, reference = random_brain(seed)
+        b = brain()
+        b.learn_many(random_sentences(seed, names, 30), batch=7)
+        assert str(b) == str(reference)
+
+
+def test_learn_many_checks():
+    from pymills.ai.deduce import fact, budget_text
+
+    b = brain()
+    chain = ["W%d is a W%d" % (i + 1, i) for i in range(300)]
+    learned, conflicts = b.learn_many(chain + [
+        "W0 likes fish",
+        "W300 likes fish",
+        "W300 likes no fish",
+        "W7 likes cats",
+    ])
+    assert learned == 302
+    assert [(c[0], c[2]) for c in conflicts] == [
+        (303, "THAT CAN'T BE RIGHT")
+    ]
+
+    # Only a fact with the verb, up both the subject's and the object's
+    # IS facts, can answer a question
+    assert b.may_know(fact("W300 likes cats")) == 1
+    assert b.may_know(fact("W3 likes cats")) == 0
+    assert b.may_know(fact("W300 hates fish")) == 0
+    assert b.may_know(fact("W300 is a fish")) == 1
+
+    # A check that runs past the budget is refused, and the load goes on
+    b.batch_nodes = 1
+    learned, conflicts = b.learn_many(["W8 likes no cats", "W9 eats fish"])
+    assert learned == 1
+    assert [(c[0], c[2]) for c in conflicts] == [(1, budget_text)]
+
+
+def test_load_file(tmpdir):
+    corpus = tmpdir.join("corpus.txt")
+    corpus.write("".join("X%d likes fish\n" % i for i in range(12000)))
+
+    b = brain()
+    learned, conflicts = b.load_file(str(corpus), check=0)
+    assert learned == 12000
+    assert conflicts == []
+    assert b.query("Does X11999 likes fish?")[0] == 1
+
+
+def test_snapshot(tmpdir):
+    from pymills.ai.deduce import save_snapshot, load_snapshot
+
+    names, b = random_brain(3)
+    b.learn("Spot likes cats")
+    b.learn("Spot can bark")
+    filename = str(tmpdir.join("brain.snapshot"))
+    assert save_snapshot(b, filename) == sum(
+        len(objects) for verbs in b.brain.values() for objects in verbs.values()
+    )
+
+    restored = load_snapshot(filename)
+    assert sorted(str(restored).splitlines()) == sorted(str(b).splitlines())
+    assert restored.brain_verb == b.brain_verb
+    assert restored.brain_obj == b.brain_obj
+    assert restored.is_up == b.is_up
+    assert restored.reverse == b.reverse
+    assert restored.query("Does Spot likes cats?")[0] == 1
+    for subj in names:
+        for obj in names:
+            question = "Is %s a %s?" % (subj, obj)
+            assert restored.query(question)[0] == b.query(question)[0]
+
+    # Version 1 snapshots held 1s for the counts, which are worked out
+    # again when they are read
+    b.learn("Rex likes cats")
+    assert b.brain_obj["CATS"] == 2
+    save_snapshot(b, filename)
+    restored = load_snapshot(filename)
+    assert restored.brain_obj == b.brain_obj
+    assert restored.brain_verb == b.brain_verb
+
+    import struct
+    from pymills.ai.deduce import snapshot_header
+    with open(filename, "r+b") as f:
+        header = list(snapshot_header.unpack(f.read(snapshot_header.size)))
+        header[1] = 1
+        f.seek(0)
+        f.write(snapshot_header.pack(*header))
+        f.seek(-(header[4] + header[5]) * 8, 2)
+        f.write(struct.pack("<I", 0) * ((header[4] + header[5]) * 2))
+    restored = load_snapshot(filename)
+    assert restored.brain_obj == b.brain_obj
+    assert restored.brain_verb == b.brain_verb
+
+    tmpdir.join("bogus").write("not a snapshot at all")
+    try:
+        load_snapshot(str(tmpdir.join("bogus")))
+    except IOError:
+        pass
+    else:
+        assert False, "loaded a bogus snapshot"
+
+
+def test_fact_slots():
+    from pickle import dumps, loads
+    from pymills.ai.deduce import fact
+
+    f = fact("Spot is not a dog")
+    assert not hasattr(f, "__dict__")
+    assert f.subj is intern("SPOT")
+
+    g = loads(dumps(f))
+    assert str(g) == str(f) == "SPOT IS NOT A DOG"
+    assert g.negative == 1
+
+
+def test_journal(tmpdir):
+    from pymills.ai.deduce import recover, checkpoint
+
+    snapshot = str(tmpdir.join("brain.snapshot"))
+    journal = str(tmpdir.join("brain.journal"))
+
+    b = recover(snapshot, journal)
+    b.learn("Spot is a dog")
+    b.learn("A dog is an animal")
+    b.learn_many(["Rex is a dog", "Spot likes cats"])
+    checkpoint(b, snapshot)
+    b.learn("Rex is not a cat")
+    b.learn("Rex is a dog")
+    b.journal.close()
+    assert len(tmpdir.join("brain.journal").readlines()) == 1
+
+    # A crash in the middle of writing a record
+    with open(journal, "ab") as f:
+        f.write("0badc0de\t+\t\tFIDO")
+
+    b = recover(snapshot, journal)
+    assert b.query("Is Spot an animal?")[0] == 1
+    assert b.query("Does Spot likes cats?")[0] == 1
+    assert b.query("Is Rex a cat?")[0] == 0
+    assert b.query("Is Fido a dog?")[0] == -1
+
+    b.learn("Fido is a dog")
+    b.journal.close()
+    b = recover(snapshot, journal)
+    assert b.query("Is Fido an animal?")[0] == 1
+
+    # Forgetting is journalled too
+    b.clear()
+    b.learn("Rex is a dog")
+    b.journal.close()
+    b = recover(snapshot, journal)
+    assert b.query("Is Fido a dog?")[0] == -1
+    assert b.query("Is Rex a dog?")[0] == 1
+    b.journal.close()
+
+
+def test_answer_cache():
+    b = brain()
+    b.learn("Spot is a dog")
+    assert b.query("Is Spot an animal?")[1] == "WHAT'S THIS \"ANIMAL\" THING?"
+    assert b.query("Is Spot an animal?")[0] == -1
+    assert b.answers.hits == 1
+
+    b.learn("A dog is an animal")
+    assert b.query("Is Spot an animal?") [0] == 1
+    assert b.query("Is Spot not an animal?")[1] == "NO, SPOT IS AN ANIMAL"
+    assert b.query("Is the Spot an animal?")[1] == "YES, THE SPOT IS AN ANIMAL"
+
+    # Only answers that depended on the new fact are thrown out
+    b.learn("Rex is a cat")
+    stats = b.answers.stats()
+    assert b.query("Is Spot an animal?")[0] == 1
+    assert b.answers.stats()["hits"] == stats["hits"] + 1
+
+
+def test_answer_cache_invalidation():
+    random = Random(42)
+    names = ["W%d" % i for i in range(6)]
+    for seed in range(4):
+        cached, plain = brain(), brain(cache=0)
+        for i in range(20):
+            subj, obj = random.choice(names), random.choice(names)
+            sentence = random.choice([
+                "%s is a %s", "%s is not a %s", "%s likes %s"
+            ]) % (subj, obj)
+            assert cached.learn(sentence)[0] == plain.learn(sentence)[0]
+            for subj in names:
+                for obj in names:
+                    for question in ("Is %s a %s?", "Does %s likes %s?"):
+                        question = question % (subj, obj)
+                        assert answer(cached, question) == answer(plain, question)
+        assert cached.answers.hits > 0
+
+
+def test_attribute_contradiction():
+    b = brain()
+    b.learn("Spot is a dog")
+    b.learn("A dog is an animal")
+    b.learn("A rock is not an animal")
+
+    ans, text, reason = b.query("Is Spot a rock?")
+    assert (ans, text) == (0, "NO, SPOT IS NOT A ROCK")
+    assert [str(r) for r in reason] == [
+        "SPOT IS A DOG", "A DOG IS AN ANIMAL", "A ROCK IS NOT AN ANIMAL"
+    ]
+
+    attrs, positive, negative = b.attributes("SPOT")
+    assert ("IS", "ANIMAL") in positive
+    assert ("IS", "ANIMAL") in b.attributes("ROCK")[2]
+
+    # Learning about an ancestor refreshes the cached attributes
+    b.learn("An animal is not a plant")
+    assert ("IS", "PLANT") in b.attributes("SPOT")[2]
+    assert b.query("Is Spot a plant?")[0] == 0
+
+
+def test_long_chain():
+    # Well past the recursion limit
+    for index, length in ((1, 2000), (0, 5000)):
+        b = brain(index=index)
+        b.learn_many(["X%d is a X%d" % (i, i + 1) for i in range(length)],
+                     check=0)
+        ans, text, reason = b.query("Is X0 a X%d?" % length)
+        assert ans == 1
+        assert len(reason) == length
+
+
+def test_search_budget():
+    b = brain(index=0)
+    b.learn_many(["X%d is a X%d" % (i, i + 1) for i in range(100)], check=0)
+    b.max_depth = 10
+    assert b.query("Is X0 a X100?") == [-1, "I DON'T KNOW (BUDGET EXCEEDED)", []]
+    assert b.learn("X0 is not a X100") == ["I DON'T KNOW (BUDGET EXCEEDED)", []]
+
+    # Answers that ran out of budget aren't remembered
+    b.max_depth = 0
+    assert b.query("Is X0 a X100?")[0] == 1
+
+
+def test_describe_budget():
+    b = brain(index=0)
+    b.learn_many(["X%d is a X%d" % (i, i + 1) for i in range(100)], check=0)
+    full = b.describe_subj("X0")
+
+    # Past the budget, a description stops rather than failing, whether
+    # or not the work is being counted
+    b.max_depth = 5
+    desc = b.describe_subj("X0")
+    assert 1 < len(desc) < len(full)
+    assert [str(f) for f in desc] == [str(f) for f in full[:len(desc)]]
+
+    b.instrument = 1
+    assert [str(f) for f in b.describe_subj("X0")] == [str(f) for f in desc]
+    assert b.stats()["describe"]["count"] == 1
+
+
+def test_shortest_proof():
+    for index in (1, 0):
+        b = brain(index=index)
+        b.learn_many([
+            "Spot is a puppy",
+            "A puppy is a whelp",
+            "A whelp is a dog",
+            "A dog is a canine",
+            "A canine is an animal",
+            "Spot is a pet",
+            "A pet is an animal",
+            "An animal is not a plant",
+        ], check=0)
+
+        ans, text, reason = b.query("Is Spot a plant?", shortest=1)
+        assert (ans, text) == (0, "NO, SPOT IS NOT A PLANT")
+        assert [str(r) for r in reason] == [
+            "SPOT IS A PET", "A PET IS AN ANIMAL", "AN ANIMAL IS NOT A PLANT"
+        ]
+
+        b.proof_limit = 2
+        assert b.query("Is Spot a plant?", shortest=1)[0] == -1
+        assert b.query("Is Spot a dog?", shortest=1)[0] == -1
+        b.proof_limit = 3
+        assert b.query("Is Spot a plant?", shortest=1)[0] == 0
+        assert b.query("Is Spot a dog?", shortest=1)[0] == 1
+
+
+def test_shortest_proof_matches_search():
+    for seed in range(10):
+        for index in (1, 0):
+            names, b = random_brain(seed, index=index)
+            for subj in names:
+                for obj in names:
+                    question = "Is %s a %s?" % (subj, obj)
+                    first = b.query(question)
+                    shortest = b.query(question, shortest=1)
+                    assert shortest[:2] == first[:2]
+                    assert len(shortest[2]) <= len(first[2])
+
+
+def test_parse_matches_sentence():
+    from pymills.ai.deduce import sentence, parse
+
+    vocabulary = [
+        "Spot", "dog", "likes", "cats", "a", "an", "the", "none", "no",
+        "not", "isn't", "doesn't", "can't", "is", "are", "am", "does",
+        "can", "has", "I'm", "you're", "every", "my", "bark", "was",
+    ]
+    random = Random(11)
+    for i in range(2000):
+        words = [random.choice(vocabulary)
+                 for j in range(random.randint(1, 7))]
+        statement = " ".join(words) + random.choice(["", ".", "?", "!"])
+
+        sent = sentence(statement)
+        question = sent.is_question()
+        phrases = []
+        while True:
+            phrase = sent.next_phrase()
+            phrases.append((
+                phrase["type"], phrase["adj"], phrase["helping_verb"],
+                phrase["primary"], phrase["negative"], phrase["error"]
+            ))
+            if phrase["type"] == "eol":
+                break
+
+        assert parse(statement) == [question, phrases], statement
+
+
+def test_parse_cache():
+    from pymills.ai.deduce import cache_parses, fact
+
+    cache = cache_parses(2)
+    try:
+        first = fact("Spot is not a dog")
+        second = fact("Spot is not a dog")
+        assert second is not first
+        assert str(second) == "SPOT IS NOT A DOG"
+        assert second.negative == 1 and second.subj is first.subj
+
+        # A fact made from the cache is its own copy
+        second.obj = "CAT"
+        assert str(fact("Spot is not a dog")) == "SPOT IS NOT A DOG"
+
+        fact("Rex is a dog")
+        fact("Fido is a dog")
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (2, 3)
+        assert (stats["size"], stats["evictions"]) == (2, 1)
+
+        b = brain()
+        assert b.learn("Spot is a dog")[0] == "OK"
+        assert b.query("Is Spot a dog?")[0] == 1
+        assert b.query("Is Spot a dog?")[0] == 1
+    finally:
+        cache_parses(0)
+
+
+def test_parse_punctuation_only():
+    from pymills.ai.deduce import fact
+
+    for statement in [". ?", "?", "!!"]:
+        f = fact(statement)
+        assert f.error == "I DON'T UNDERSTAND", statement
+
+    b = brain()
+    assert b.learn(". ?")[0] == "I DON'T UNDERSTAND"
+    learned, conflicts = b.learn_many(["Spot is a dog", ". ?", "Rex is a dog"])
+    assert learned == 2
+    assert [c[:3] for c in conflicts] == [[2, ". ?", "I DON'T UNDERSTAND"]]
+
+
+def test_server(tmpdir):
+    import socket
+    from threading import Thread
+    from pymills.ai.deduce import tcp_server, unix_server
+
+    def serve(server):
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def converse(address, family, lines):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.connect(address)
+        f = sock.makefile("rwb", 0)
+        replies = []
+        for line in lines:
+            f.write(line + "\n")
+            replies.append(f.readline().rstrip("\n"))
+        return sock, f, replies
+
+    tcp = serve(tcp_server(("localhost", 0)))
+    address = tcp.server_address
+    try:
+        sock, f, replies = converse(address, socket.AF_INET, [
+            "Spot is a dog", "A dog is an animal", "Is Spot an animal?",
+        ])
+        assert replies == ["OK", "OK", "YES, SPOT IS AN ANIMAL"]
+
+        # Another connection shares the brain but not the WHY state
+        other, g, replies = converse(address, socket.AF_INET, [
+            "Is Spot a dog?",
+        ])
+        assert replies == ["YES, SPOT IS A DOG"]
+        sock2, f2, replies = converse(address, socket.AF_INET, ["WHY"])
+        assert replies[0] == "*SHRUG*"
+
+        f.write("WHY\n")
+        assert f.readline() == "BECAUSE:\n"
+        assert f.readline() == "  SPOT IS A DOG\n"
+        assert f.readline() == "  A DOG IS AN ANIMAL\n"
+
+        f.write("FORGET\n")
+        assert f.readline() == "FORGOTTEN\n"
+        g.write("Is Spot a dog?\n")
+        assert g.readline() == "WHAT'S THIS \"SPOT\" THING?\n"
+        g.write("QUIT\n")
+        assert g.readline() == "GOODBYE\n"
+        assert g.readline() == ""
+        for s in (sock, other, sock2):
+            s.close()
+    finally:
+        tcp.shutdown()
+        tcp.server_close()
+
+    path = str(tmpdir.join("deduce.sock"))
+    unix = serve(unix_server(path))
+    try:
+        sock, f, replies = converse(path, socket.AF_UNIX, [
+            "Rex is a cat", "Does Rex is a cat?", "Is Rex a cat?",
+        ])
+        assert replies[0] == "OK"
+        assert replies[2] == "YES, REX IS A CAT"
+        sock.close()
+    finally:
+        unix.shutdown()
+        unix.server_close()
+
+
+def test_server_survives_errors(monkeypatch):
+    import socket
+    from threading import Thread
+    from pymills.ai.deduce import tcp_server, session
+
+    command = session.command
+
+    def fussy(self, quote):
+        if quote.strip() == "BOOM":
+            raise ValueError("boom")
+        return command(self, quote)
+
+    monkeypatch.setattr(session, "command", fussy)
+
+    tcp = tcp_server(("localhost", 0))
+    thread = Thread(target=tcp.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        sock = socket.create_connection(tcp.server_address)
+        f = sock.makefile("rwb", 0)
+        for line, reply in [(". ?", "I DON'T UNDERSTAND"),
+                            ("BOOM", "** Error: boom"),
+                            ("Spot is a dog", "OK")]:
+            f.write(line + "\n")
+            assert f.readline() == reply + "\n"
+        sock.close()
+    finally:
+        tcp.shutdown()
+        tcp.server_close()
+
+
+def test_query_many():
+    names, b = random_brain(5)
+    _, plain = random_brain(5, cache=0)
+    questions = ["Is %s a %s?" % (s, o) for o in names for s in names] * 2
+    expected = [answer(b, q) for q in questions]
+
+    for brain_, kwargs in ((b, {}), (plain, {"chunk": 7}),
+                           (plain, {"processes": 2, "chunk": 30})):
+        results = brain_.query_many(iter(questions), **kwargs)
+        assert [(ans, text, [str(r) for r in reason])
+                for ans, text, reason in results] == expected
+
+
+def test_query_many_shares_attributes():
+    b = brain(cache=0)
+    b.learn_many(["Spot is a dog", "A dog is an animal", "Rex is a cat"])
+    calls = []
+    describe = b.describe_subj_i
+    b.describe_subj_i = lambda subject, *args: (
+        calls.append(subject) or describe(subject, *args)
+    )
+
+    questions = ["Is Spot a %s?" % w for w in ("cat", "Rex", "fish")] * 2
+    answers = list(b.query_many(questions))
+    assert [ans for ans, text, reason in answers] == [-1] * 6
+    assert sorted(set(calls)) == sorted(calls)
+
+
+def test_query_many_forked_with_locks_held():
+    from threading import Thread
+    from pymills.ai.deduce import cache_parses
+
+    names, b = random_brain(5)
+    questions = ["Is %s a %s?" % (s, o) for o in names for s in names]
+    expected = [answer(b, q) for q in questions]
+    parses = cache_parses(100)
+    results = []
+
+    # Another thread holds the caches' locks as the workers are forked
+    b.answers.lock.acquire()
+    b.attrs.lock.acquire()
+    parses.lock.acquire()
+    try:
+        t = Thread(target=lambda: results.extend(
+            b.query_many(questions, processes=1, chunk=10)))
+        t.daemon = True
+        t.start()
+        t.join(30)
+        assert not t.is_alive()
+    finally:
+        b.answers.lock.release()
+        b.attrs.lock.release()
+        parses.lock.release()
+        cache_parses(0)
+
+    assert [(ans, text, [str(r) for r in reason])
+            for ans, text, reason in results] == expected
+
+
+def test_enumeration():
+    b = brain()
+    b.learn_many([
+        "Spot is a dog",
+        "Rex is a dog",
+        "A dog is an animal",
+        "A cat is an animal",
+        "Tom is a cat",
+        "A cat likes fish",
+        "Rex doesnt likes fish",
+        "Felix is a cat",
+        "A seal likes fish",
+        "A dog is not a plant",
+    ])
+
+    assert sorted(b.reverse["ANIMAL"]["IS"]) == ["CAT", "DOG"]
+    assert set(b.descendants("ANIMAL")) == set(
+        ["DOG", "CAT", "SPOT", "REX", "TOM", "FELIX"]
+    )
+    assert sorted(b.instances("ANIMAL")) == ["FELIX", "REX", "SPOT", "TOM"]
+    assert sorted(b.subclasses("ANIMAL")) == ["CAT", "DOG"]
+    assert sorted(b.subjects("LIKES", "FISH")) == ["CAT", "FELIX", "SEAL", "TOM"]
+    assert sorted(b.subjects("LIKES", "FISH", negative=1)) == ["REX"]
+    assert sorted(b.subjects("IS", "PLANT", negative=1)) == [
+        "DOG", "REX", "SPOT"
+    ]
+
+    [(word, attrs)] = [
+        pair for pair in b.instances("CAT", describe=1) if pair[0] == "TOM"
+    ]
+    assert "TOM IS AN ANIMAL" in [str(f) for f in attrs]
+
+    # Results come out as they are found
+    words = b.descendants("ANIMAL")
+    assert next(words) in ("DOG", "CAT")
+
+
+def test_subjects_through_object_kinds():
+    for index in (0, 1):
+        b = brain(index=index)
+        b.learn_many([
+            "A fish is a food",
+            "A food is a thing",
+            "Bob likes food",
+            "Carl likes thing",
+            "Ann likes fish",
+            "Dan is a Bob",
+        ])
+
+        assert b.query("Does Bob likes fish?")[0] == 1
+        assert sorted(b.subjects("LIKES", "FISH")) == [
+            "ANN", "BOB", "CARL", "DAN"
+        ]
+        assert sorted(b.subjects("LIKES", "FOOD")) == ["BOB", "CARL", "DAN"]
+        assert sorted(
+            word for word in b.brain if b.query("Does %s likes fish?" % word)[0] == 1
+        ) == sorted(b.subjects("LIKES", "FISH"))
+
+
+def test_forget():
+    b = brain()
+    b.learn("Spot is a dog")
+    b.learn("A dog is an animal")
+    b.learn("Spot likes cats")
+    assert b.query("Is Spot an animal?")[0] == 1
+
+    assert b.forget("Spot is not a dog")[0] == "I DIDN'T KNOW THAT"
+    msg, reason = b.forget("Spot is a dog")
+    assert msg == "FORGOTTEN" and [str(r) for r in reason] == ["SPOT IS A DOG"]
+    assert b.query("Is Spot an animal?")[0] == -1
+    assert "ANIMAL" not in b.is_up.get("SPOT", ())
+    assert "DOG" not in b.brain_obj
+
+    b.forget("Spot likes cats")
+    assert "LIKES" not in b.brain_verb
+    assert b.query("Does Spot likes cats?")[1] == "WHAT'S THIS \"SPOT\" THING?"
+    assert b.learn("Spot is not a dog")[0] == "OK"
+
+
+def test_forget_matches_relearning():
+    for seed in range(10):
+        random = Random(seed)
+        names = ["W%d" % i for i in range(8)]
+        sentences = list(random_sentences(seed, names, 16))
+        sentences += ["%s likes %s" % (random.choice(names), random.choice(names))
+                      for i in range(10)]
+
+        b = brain()
+        b.learn_many(sentences, check=0)
+        stored = [str(f) for verbs in b.brain.values()
+                  for objects in verbs.values() for f in objects.values()]
+        forgotten = random.sample(stored, len(stored) // 2)
+        for sentence in forgotten:
+            assert b.forget(sentence)[0] == "FORGOTTEN"
+
+            # Answers cached before are still right afterwards
+            for subj in names[:3]:
+                for obj in names:
+                    b.query("Is %s a %s?" % (subj, obj))
+
+        fresh = brain()
+        fresh.learn_many([s for s in stored if s not in forgotten], check=0)
+        assert sorted(str(b).splitlines()) == sorted(str(fresh).splitlines())
+        for name in ("brain_verb", "brain_obj", "is_up", "is_down",
+                     "is_into", "reverse"):
+            assert getattr(b, name) == getattr(fresh, name), name
+        for subj in names:
+            for obj in names:
+                for question in ("Is %s a %s?", "Does %s likes %s?"):
+                    question = question % (subj, obj)
+                    assert answer(b, question) == answer(fresh, question)
+
+
+def test_stats():
+    b = brain(index=0, cache=0)
+    b.learn_many(["X%d is a X%d" % (i, i + 1) for i in range(20)], check=0)
+    b.query("Is X0 a X20?")
+    assert b.stats() == {}
+
+    calls = []
+    b.instrument = 1
+    b.hooks.append(lambda *args: calls.append(args))
+    b.query("Is X0 a X20?")
+    b.learn("X20 is a Y")
+    b.describe_subj("X18")
+
+    stats = b.stats()
+    assert stats["query"]["count"] == 1
+    assert stats["query"]["nodes"] == 20
+    assert stats["query"]["deepest"] == 20
+    assert stats["query"]["copied"] == 19
+    assert stats["learn"]["count"] == 1
+    assert stats["describe"]["copied"] >= 3
+    assert [call[0] for call in calls] == ["query", "learn", "describe"]
+    assert str(calls[0][1]) == "X0 IS A X20"
+    assert calls[0][2].visited == 20
+
+    b.reset_stats()
+    assert b.stats() == {}
+
+
+def test_write_facts(tmpdir):
+    from StringIO import StringIO
+    from pymills.ai.deduce import session
+
+    names, b = random_brain(2)
+    b.learn("Spot likes cats")
+    out = StringIO()
+    count = b.write_facts(out, chunk=4)
+    assert out.getvalue() == str(b)
+    assert count == len(str(b).splitlines())
+    assert len(list(b.iterfacts())) == sum(
+        len(objects) for verbs in b.brain.values() for objects in verbs.values()
+    )
+
+    # Nothing is left locked, whether or not every fact was read
+    facts = b.iterfacts()
+    next(facts)
+    facts.close()
+    assert b.learn("Rex likes cats")[0] == "OK"
+
+    # Nor while the facts are being written
+    class slow_reader(object):
+        def write(self, text):
+            t = Thread(target=b.learn, args=("Tom likes cats",))
+            t.start()
+            t.join(5)
+            assert not t.is_alive()
+
+    from threading import Thread
+    b.write_facts(slow_reader(), chunk=4)
+    assert b.query("Does Tom likes cats?")[0] == 1
+
+    saved = tmpdir.join("saved.txt")
+    s = session(b, StringIO())
+    s.command("SAVE %s" % saved)
+    assert saved.read() == str(b)
+
+
+def test_batch():
+    import json
+    from StringIO import StringIO
+    from pymills.ai.deduce import batch
+
+    script = [
+        "Tom is a cat",
+        "A cat is an animal",
+        "",
+        "Is Tom an animal?",
+        "Is Tom a cat?",
+        "Tom is a cat",
+        "Tom is not an animal",
+        "why",
+        "quit",
+        "Tom is a dog",
+    ]
+
+    b = brain()
+    out = StringIO()
+    assert batch(b, script, out, chunk=2) == 8
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["line"] for r in results] == [1, 2, 4, 5, 6, 7, 8, 9]
+    assert [r["type"] for r in results] == [
+        "statement", "statement", "question", "question",
+        "statement", "statement", "command", "command"]
+    assert [r["code"] for r in results] == [1, 1, 1, 1, 0, -1, 1, 1]
+    assert results[2]["text"] == "YES, TOM IS AN ANIMAL"
+    assert results[2]["reason"] == ["TOM IS A CAT", "A CAT IS AN ANIMAL"]
+    assert results[6]["text"].startswith("BECAUSE:")
+    assert results[7]["text"] == "GOODBYE"
+
+    # Nothing after QUIT was run
+    assert b.query("Is Tom a dog?")[0] == -1
+
+
+def test_batch_errors():
+    import json
+    from StringIO import StringIO
+    from pymills.ai.deduce import batch
+
+    b = brain()
+    learn = b.learn
+
+    def fussy(f):
+        if f.subj == "BOOM":
+            raise ValueError("boom")
+        return learn(f)
+
+    b.learn = fussy
+
+    out = StringIO()
+    script = ["Tom is a cat", "Is Tom a cat?", "Boom is a bang", ". ?",
+              "Rex is a dog"]
+    assert batch(b, script, out) == 5
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r["line"], r["type"], r["code"]) for r in results] == [
+        (1, "statement", 1), (2, "question", 1), (3, "error", -1),
+        (4, "statement", -1), (5, "statement", 1)]
+    assert results[2]["text"] == "ValueError: boom"
+    assert results[3]["text"] == "I DON'T UNDERSTAND"
+
+
+def test_replicas():
+    from pymills.ai.deduce import replicas
+
+    names, b = random_brain(5)
+    questions = ["Is %s a %s?" % (s, o) for o in names for s in names]
+
+    r = replicas(b, processes=2, chunk=7, every=2)
+    try:
+        expected = [answer(b, q) for q in questions]
+        assert [(ans, text, [str(x) for x in reason])
+                for ans, text, reason in r.query_many(questions)] == expected
+
+        # The workers only hear about new facts when they are published
+        assert r.learn("Rover is a %s" % names[0])[0] == "OK"
+        assert r.query("Is Rover a %s?" % names[0])[0] == -1
+        assert r.learn("Rex is a %s" % names[0])[0] == "OK"
+        assert r.query("Is Rover a %s?" % names[0])[0] == 1
+        assert r.changes == 0
+
+        assert r.forget("Rover is a %s" % names[0])[0] == "FORGOTTEN"
+        r.publish()
+        assert r.query("Is Rover a %s?" % names[0])[0] == -1
+        assert r.query("Is Rex a %s?" % names[0])[0] == 1
+    finally:
+        r.close()
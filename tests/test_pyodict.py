@@ -0,0 +1,291 @@
+from pickle import dumps, loads
+from random import Random
+
+import pytest
+
+from pymills.pyodict import odict, codict
+
+
+@pytest.fixture(params=[odict, codict])
+def kind(request):
+    return request.param
+
+
+def test_order(kind):
+    d = kind([("b", 2), ("a", 1), ("c", 3)])
+    d["a"] = 10
+    d["d"] = 4
+
+    assert d.keys() == ["b", "a", "c", "d"]
+    assert d.values() == [2, 10, 3, 4]
+    assert d.rkeys() == ["d", "c", "a", "b"]
+    assert d.rvalues() == [4, 3, 10, 2]
+    assert list(reversed(d)) == ["d", "c", "a", "b"]
+    assert d.firstkey() == "b"
+    assert d.lastkey() == "d"
+
+    del d["a"]
+    assert d.items() == [("b", 2), ("c", 3), ("d", 4)]
+    assert d.popitem() == ("d", 4)
+    assert d.ritems() == [("c", 3), ("b", 2)]
+    assert d.as_dict() == {"b": 2, "c": 3}
+    assert d.copy().items() == d.items()
+
+
+def test_membership(kind):
+    d = kind((i, i * i) for i in range(100))
+
+    assert len(d) == 100
+    assert 50 in d
+    assert 100 not in d
+    assert d.get(7) == 49
+    assert d.get(100) is None
+    assert d.get(100, -1) == -1
+
+    assert d.setdefault(7, 0) == 49
+    assert d.setdefault(100, 0) == 0
+    assert len(d) == 101
+    assert d.lastkey() == 100
+
+    assert d.pop(100) == 0
+    assert d.pop(100, "gone") == "gone"
+    with pytest.raises(KeyError):
+        d.pop(100)
+
+    d.clear()
+    assert len(d) == 0
+    assert not d
+    assert 7 not in d
+    with pytest.raises(KeyError):
+        d.firstkey()
+
+
+def test_sort(kind):
+    d = kind([("b", 3), ("c", 1), ("a", 2)])
+
+    d.sort()
+    assert d.items() == [("c", 1), ("a", 2), ("b", 3)]
+    d.sort(key=lambda item: item[0])
+    assert d.items() == [("a", 2), ("b", 3), ("c", 1)]
+    d.sort(key=lambda item: item[0], reverse=True)
+    assert d.keys() == ["c", "b", "a"]
+    assert d["a"] == 2
+
+
+def test_codict_tombstones():
+    d = codict((i, str(i)) for i in range(100))
+    expected = [(i, str(i)) for i in range(100)]
+
+    # Delete from the front, the back and the middle, as a cache would
+    for i in range(0, 100, 3):
+        del d[i]
+    del d[98]
+    del d[97]
+    expected = [(k, v) for k, v in expected if k % 3 and k < 97]
+    assert d.items() == expected
+    assert d.ritems() == expected[::-1]
+    assert d.firstkey() == 1
+    assert d.lastkey() == 95
+    assert len(d._keys) < 100
+
+    for i in range(100, 150):
+        d[i] = str(i)
+        del d[d.firstkey()]
+        expected.append((i, str(i)))
+        del expected[0]
+    assert d.items() == expected
+    assert [d[k] for k, v in expected] == [v for k, v in expected]
+    assert len(d._keys) <= 2 * len(d) + 1
+
+    while d:
+        k, v = d.popitem()
+        assert (k, v) == expected.pop()
+    assert d._keys == []
+    d["x"] = 1
+    assert d.items() == [("x", 1)]
+
+
+def test_codict_equality():
+    d = codict([("a", 1), ("b", 2)])
+
+    assert d == codict([("a", 1), ("b", 2)])
+    assert d != codict([("b", 2), ("a", 1)])
+    assert d != codict([("a", 1), ("b", 3)])
+    assert d == {"a": 1, "b": 2}
+    assert loads(dumps(d)).items() == d.items()
+    assert loads(dumps(d, 2)).items() == d.items()
+
+
+def test_pickle_after_positions(kind):
+    d = kind((i, i) for i in range(10))
+    d.index(3)
+    del d[4]
+
+    for protocol in (0, 1, 2):
+        e = loads(dumps(d, protocol))
+        assert list(e.islice(0, 10)) == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+        assert e.index(9) == 8
+        del e[0]
+        e[10] = 10
+        assert e.keys() == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+        assert e.at(-1) == 10
+    assert d.keys() == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+
+
+def test_codict_slots():
+    from copy import copy
+
+    d = codict([("a", 1), ("b", 2)])
+    del d["a"]
+    assert not hasattr(d, "__dict__")
+    with pytest.raises(AttributeError):
+        d.other = 1
+
+    for protocol in (0, 1, 2):
+        e = loads(dumps(d, protocol))
+        assert e.items() == [("b", 2)] and e.at(0) == "b"
+    assert copy(d).items() == [("b", 2)]
+
+
+def test_positions(kind):
+    d = kind((c, i) for i, c in enumerate("abcdef"))
+    del d["c"]
+
+    assert [d.index(k) for k in "abdef"] == [0, 1, 2, 3, 4]
+    assert [d.at(i) for i in range(5)] == list("abdef")
+    assert d.at(-1) == "f"
+    assert list(d.islice(1, 3)) == ["b", "d"]
+    assert list(d.islice(-2)) == ["e", "f"]
+    assert list(d.islice(3, 1)) == []
+    with pytest.raises(ValueError):
+        d.index("c")
+    with pytest.raises(IndexError):
+        d.at(5)
+
+
+def test_codict_positions():
+    random = Random(0)
+    d = codict()
+    expected = []
+
+    for step in range(3000):
+        if expected and random.random() < 0.4:
+            key = random.choice(expected)
+            del d[key]
+            expected.remove(key)
+        else:
+            key = step
+            d[key] = step
+            expected.append(key)
+
+        if step % 50 == 0 and expected:
+            i = random.randrange(len(expected))
+            assert d.at(i) == expected[i]
+            assert d.index(expected[i]) == i
+            assert list(d.islice(i, i + 5)) == expected[i:i + 5]
+
+    assert [d.at(i) for i in range(len(d))] == expected
+    assert [d.index(k) for k in expected] == list(range(len(expected)))
+
+
+def test_sort_in_place(kind):
+    d = kind([("b", 3), ("c", 1), ("a", 2), ("d", 1)])
+
+    d.sort(cmp=lambda x, y: cmp(y[0], x[0]))
+    assert d.keys() == ["d", "c", "b", "a"]
+    d.sort(reverse=True)
+    assert d.items() == [("b", 3), ("a", 2), ("c", 1), ("d", 1)]
+    assert d.rkeys() == ["d", "c", "a", "b"]
+    d["e"] = 0
+    assert d.firstkey() == "b"
+    assert d.lastkey() == "e"
+
+
+def test_move_to_end(kind):
+    d = kind((c, i) for i, c in enumerate("abcde"))
+
+    d.move_to_end("b")
+    assert d.keys() == list("acdeb")
+    d.move_to_end("b")
+    d.move_to_front("e")
+    assert d.keys() == list("eacdb")
+    d.move_to_front("e")
+    d.move_to_end("a", last=False)
+    d.move_to_front("b")
+    assert d.items() == [("b", 1), ("a", 0), ("e", 4), ("c", 2), ("d", 3)]
+    assert d.rkeys() == list("dceab")
+    assert [d.index(k) for k in "baecd"] == [0, 1, 2, 3, 4]
+    with pytest.raises(KeyError):
+        d.move_to_end("z")
+
+    d = kind([("x", 1)])
+    d.move_to_front("x")
+    d.move_to_end("x")
+    assert d.items() == [("x", 1)]
+
+
+def test_codict_moves():
+    random = Random(0)
+    d = codict((i, i) for i in range(50))
+    expected = list(range(50))
+
+    for step in range(2000):
+        key = random.choice(expected)
+        expected.remove(key)
+        if random.random() < 0.5:
+            d.move_to_end(key)
+            expected.append(key)
+        else:
+            d.move_to_front(key)
+            expected.insert(0, key)
+        if step % 100 == 0:
+            assert d.at(step % 50) == expected[step % 50]
+
+    assert d.keys() == expected
+    assert d.rkeys() == expected[::-1]
+    assert [d[k] for k in expected] == expected
+    assert len(d._keys) <= 3 * len(d)
+
+
+def test_odict_positions():
+    random = Random(0)
+    d = odict((i, i) for i in range(50))
+    expected = list(range(50))
+    assert d.at(10) == 10
+    n = 50
+
+    for step in range(3000):
+        action = random.random()
+        if action < 0.3:
+            d[n] = n
+            expected.append(n)
+            n += 1
+        elif action < 0.6 and expected:
+            key = random.choice(expected)
+            del d[key]
+            expected.remove(key)
+        elif expected:
+            key = random.choice(expected)
+            expected.remove(key)
+            if action < 0.8:
+                d.move_to_end(key)
+                expected.append(key)
+            else:
+                d.move_to_front(key)
+                expected.insert(0, key)
+        if step % 50 == 0 and expected:
+            i = random.randrange(len(expected))
+            assert d.at(i) == expected[i]
+            assert d.at(-1) == expected[-1]
+            assert d.index(expected[i]) == i
+            assert list(d.islice(i, i + 5)) == expected[i:i + 5]
+
+    assert d.keys() == expected
+    assert [d.index(k) for k in expected] == list(range(len(expected)))
+    assert list(d.islice()) == expected
+
+    d.sort()
+    assert d.at(0) == min(expected)
+    d.clear()
+    d[1] = 1
+    assert d.index(1) == 0